@@ -5,7 +5,32 @@ set -euo pipefail
 # Configuration
 CONFIG_FILE="$HOME/Documents/apps.yaml"
 INSTALLED_FILE="$HOME/.local/share/appfetch/installed.yaml"
+INDEX_FILE="${CONFIG_FILE%/*}/.${CONFIG_FILE##*/}.index"
+SEARCH_INDEX_FILE="${CONFIG_FILE%/*}/.${CONFIG_FILE##*/}.search"
+KEYS_FILE="${CONFIG_FILE%/*}/.${CONFIG_FILE##*/}.keys"
+DAEMON_SOCKET="${APPFETCH_SOCKET:-${CONFIG_FILE%/*}/.${CONFIG_FILE##*/}.sock}"  # see downloadscripts/appfetchd.py
+UPDATE_URL="${APPFETCH_UPDATE_URL:-https://raw.githubusercontent.com/Tsu-gu/appfetch/refs/heads/main/apps.yaml}"
+UPDATE_DELTA_URL="${APPFETCH_DELTA_URL:-}"  # optional, see apply_database_delta
 PREFER_SNAP=true
+SEARCH_LIMIT=20  # results shown per query, 0 shows every match
+JOBS=1           # custom installs run at once, override with -j N
+
+# Download cache for custom installs, can live on a shared NFS mount
+DOWNLOAD_CACHE_DIR="${APPFETCH_CACHE_DIR:-$HOME/.cache/appfetch/downloads}"
+DOWNLOAD_CACHE_MAX_MB=4096     # 0 for no limit
+DOWNLOAD_CACHE_URL_TTL_DAYS=7  # re-fetch downloads without a checksum after this
+
+# Offline bundle written by appfetch prefetch, installs use it with --from-bundle DIR
+BUNDLE_DIR=""
+
+# Timing: APPFETCH_TRACE=1 writes JSON-lines spans to TRACE_FILE, and every
+# install/remove attempt is kept in HISTORY_FILE for appfetch stats
+TRACE_FILE="${APPFETCH_TRACE_FILE:-$HOME/.cache/appfetch/trace.jsonl}"
+HISTORY_FILE="$HOME/.local/share/appfetch/history.tsv"
+
+# Snapshot of installed snaps/flatpaks, reused by runs within INVENTORY_TTL seconds
+INVENTORY_FILE="$HOME/.cache/appfetch/inventory"
+INVENTORY_TTL=300
 
 # Colors for output
 readonly RED='\033[0;31m'
@@ -21,21 +46,114 @@ log_warning() { echo -e "${YELLOW}⚠️  $*${NC}"; }
 log_info() { echo -e "${BLUE}ℹ️  $*${NC}"; }
 log_search() { echo -e "🔎 $*"; }
 
+# Set the named variable to the current time in microseconds
+clock_us() {
+    local -n clock_var="$1"
+    clock_var="${EPOCHREALTIME//[!0-9]/}"
+}
+
+# Set the named variable to microseconds formatted as seconds, e.g. 12.345
+format_seconds() {
+    local -n seconds_var="$1"
+    printf -v seconds_var '%d.%03d' $(( $2 / 1000000 )) $(( $2 % 1000000 / 1000 ))
+}
+
+# Append a span to TRACE_FILE when tracing is on
+# Usage: trace_span phase app method start_us duration_us [status]
+trace_span() {
+    [[ "${APPFETCH_TRACE:-0}" == "1" ]] || return 0
+    local phase="$1" app="$2" method="$3" start_us="$4" duration_us="$5" status="${6:-0}"
+    local duration
+    
+    app="${app//\\/\\\\}"
+    app="${app//\"/\\\"}"
+    format_seconds duration "$duration_us"
+    
+    mkdir -p "${TRACE_FILE%/*}"
+    printf '{"phase":"%s","app":"%s","method":"%s","start":%d.%06d,"duration":%s,"status":%d,"pid":%d}\n' \
+        "$phase" "$app" "$method" $(( start_us / 1000000 )) $(( start_us % 1000000 )) \
+        "$duration" "$status" "$BASHPID" >> "$TRACE_FILE"
+}
+
+# Trace a span that started at start_us and ends now
+# Usage: trace_since phase app method start_us [status]
+trace_since() {
+    [[ "${APPFETCH_TRACE:-0}" == "1" ]] || return 0
+    local now_us
+    clock_us now_us
+    trace_span "$1" "$2" "$3" "$4" $(( now_us - $4 )) "${5:-0}"
+}
+
 # Global associative array for parsed YAML data
 declare -A YAML_DATA
 
-# Universal YAML parser - loads all data into YAML_DATA
+# Reverse map of alias -> app name, built alongside YAML_DATA
+declare -A ALIAS_INDEX
+
+# Reverse map of "manager:package" -> app name for snap and flatpak
+declare -A PACKAGE_INDEX
+
+# Search index: word -> "app:weight ..." and trigram -> "word ..."
+declare -A SEARCH_TOKENS
+declare -A SEARCH_TRIGRAMS
+SEARCH_WORDS=()
+
+# Relevance of a word by where it appears, and the minimum trigram
+# similarity (percent) for a fuzzy match to count
+readonly WEIGHT_NAME=100
+readonly WEIGHT_ALIAS=80
+readonly WEIGHT_COMMENT=40
+readonly FUZZY_MIN_SIMILARITY=30
+
+# Words too common in comments to be worth indexing
+declare -rA SEARCH_STOPWORDS=(
+    [an]=1 [and]=1 [the]=1 [of]=1 [for]=1 [to]=1 [in]=1 [on]=1 [with]=1
+    [your]=1 [you]=1 [is]=1 [it]=1 [by]=1 [from]=1 [or]=1 [as]=1 [at]=1
+)
+
+# Installed-state store loaded from INSTALLED_FILE, indexed by app and by
+# "method:package", plus the journal of changes made during this run
+declare -A INSTALLED_DATA
+declare -A INSTALLED_PACKAGES
+STATE_JOURNAL=""
+readonly STATE_FIELDS=(method package installed_at duration)
+
+# Apps whose custom install failed during install_custom_apps
+CUSTOM_FAILED=()
+
+# Packages that failed in the current snap/flatpak batch, see run_batch,
+# and the ones validate_packages let through
+BATCH_FAILED=()
+VALID_PACKAGES=()
+
+# Snap/flatpak batches running in the background, see start_manager_batches
+declare -A BATCH_PIDS
+BATCH_STATUS_DIR=""
+
+# Installed snaps and flatpaks as "manager:package", and the managers that answered
+declare -A INVENTORY
+declare -A INVENTORY_OK
+INVENTORY_LOADED=false
+
+# Universal YAML parser - loads all data into YAML_DATA (or the named array)
 # Format: YAML_DATA["app_name:field"] = "value"
 parse_yaml_file() {
     local yaml_file="$1"
-    local app="" in_app=false
+    local -n parsed_data="${2:-YAML_DATA}"
     
     # Clear previous data
-    unset YAML_DATA
-    declare -gA YAML_DATA
+    parsed_data=()
     
     [[ ! -f "$yaml_file" ]] && return 1
     
+    parse_yaml_lines "${2:-YAML_DATA}" < "$yaml_file"
+}
+
+# Add the entries read from stdin to the named array, as parse_yaml_file does
+parse_yaml_lines() {
+    local -n parsed_data="$1"
+    local app="" in_app=false line
+    
     while IFS= read -r line || [[ -n $line ]]; do
         # Match app name line
         if [[ $line =~ ^([a-zA-Z0-9_-]+):$ ]]; then
@@ -55,13 +173,328 @@ parse_yaml_file() {
                     value="${BASH_REMATCH[1]}"
                 fi
                 
-                YAML_DATA["$app:$field"]="$value"
+                parsed_data["$app:$field"]="$value"
             elif [[ ! $line =~ ^[[:space:]] ]]; then
                 # End of app block
                 in_app=false
             fi
         fi
-    done < "$yaml_file"
+    done
+}
+
+# Bump when the layout of the cached index changes
+readonly INDEX_VERSION=3
+
+# Bump when the layout of the key index changes
+readonly KEYS_VERSION=1
+
+# A key index lookup costs about as much as loading this many bytes of
+# database from the cached index, so few apps in a big database use lookups
+readonly KEYS_LOOKUP_BYTES=102400
+
+# Set when load_config has loaded the whole database
+CONFIG_LOADED=false
+
+# Cache key for a file: mtime and size
+file_stamp() {
+    stat -c '%.9Y %s' "$1" 2>/dev/null
+}
+
+# Build ALIAS_INDEX from the aliases fields in YAML_DATA
+build_alias_index() {
+    local key app alias
+    local alias_array=()
+    
+    unset ALIAS_INDEX
+    declare -gA ALIAS_INDEX
+    
+    for key in "${!YAML_DATA[@]}"; do
+        [[ $key == *":aliases" ]] || continue
+        app="${key%:*}"
+        
+        IFS=',' read -ra alias_array <<< "${YAML_DATA[$key]}"
+        for alias in "${alias_array[@]}"; do
+            # Trim whitespace
+            alias="${alias#"${alias%%[![:space:]]*}"}"
+            alias="${alias%"${alias##*[![:space:]]}"}"
+            [[ -z "$alias" ]] && continue
+            
+            # An alias shared by several apps resolves to the first by name
+            if [[ -z "${ALIAS_INDEX[$alias]:-}" || "$app" < "${ALIAS_INDEX[$alias]}" ]]; then
+                ALIAS_INDEX["$alias"]="$app"
+            fi
+        done
+    done
+}
+
+# Build PACKAGE_INDEX from the snap and flatpak fields in YAML_DATA
+build_package_index() {
+    local key app package
+    
+    unset PACKAGE_INDEX
+    declare -gA PACKAGE_INDEX
+    
+    for key in "${!YAML_DATA[@]}"; do
+        [[ $key == *":snap" || $key == *":flatpak" ]] || continue
+        app="${key%:*}"
+        package="${key##*:}:${YAML_DATA[$key]}"
+        
+        # A package shared by several apps belongs to the first by name
+        if [[ -z "${PACKAGE_INDEX[$package]:-}" || "$app" < "${PACKAGE_INDEX[$package]}" ]]; then
+            PACKAGE_INDEX["$package"]="$app"
+        fi
+    done
+}
+
+# Build the in-memory indexes for the apps database
+build_config_index() {
+    parse_yaml_file "$CONFIG_FILE" || return 1
+    build_alias_index
+    build_package_index
+}
+
+# Load arrays from a compiled index, rebuilding it when the database changed
+# Usage: load_cached_index <index_file> <builder> <array>...
+load_cached_index() {
+    local index_file="$1" builder="$2"
+    shift 2
+    local stamp="appfetch-index v$INDEX_VERSION $(file_stamp "$CONFIG_FILE")"
+    local header=""
+    
+    if [[ -f "$index_file" ]] && IFS= read -r header < "$index_file" && [[ "$header" == "# $stamp" ]]; then
+        source "$index_file"
+        return 0
+    fi
+    
+    "$builder" || return 1
+    
+    # Caching is best effort, a read-only config directory only costs speed
+    local temp_file
+    temp_file=$(mktemp "$index_file.XXXXXX" 2>/dev/null) || return 0
+    if {
+        echo "# $stamp"
+        declare -p "$@" | sed 's/^declare -A /declare -gA /'
+    } > "$temp_file"; then
+        mv -f "$temp_file" "$index_file"
+    else
+        rm -f "$temp_file"
+    fi
+}
+
+# Load the apps database through its compiled index
+load_config() {
+    [[ $CONFIG_LOADED == true ]] && return 0
+    load_cached_index "$INDEX_FILE" build_config_index YAML_DATA ALIAS_INDEX PACKAGE_INDEX
+    CONFIG_LOADED=true
+    
+    if ! key_index_valid; then
+        build_key_index "$CONFIG_FILE" "$KEYS_FILE" || log_warning "Could not write $KEYS_FILE"
+    fi
+}
+
+# Write the sorted key index of a database: a "# appfetch-keys" header with
+# the database's size and sha256, then "key<TAB>app<TAB>offset<TAB>length" for
+# every app name and alias, where offset/length is the entry's byte span
+# Sorted bytewise so it can be binary searched (see downloadscripts/appsyaml.py)
+build_key_index() {
+    local yaml_file="$1" output="$2"
+    local temp_file size sum
+    
+    size=$(stat -c %s "$yaml_file") || return 1
+    sum=$(sha256_of "$yaml_file") || return 1
+    temp_file=$(mktemp "$output.XXXXXX") || return 1
+    
+    {
+        echo "# appfetch-keys v$KEYS_VERSION $size $sum"
+        LC_ALL=C awk -v OFS='\t' '
+            function flush(    count, i, aliases) {
+                if (app == "") return
+                print app, app, start, offset - start
+                count = split(alias_list, aliases, ",")
+                for (i = 1; i <= count; i++) {
+                    gsub(/^[ \t]+|[ \t]+$/, "", aliases[i])
+                    if (aliases[i] != "") print aliases[i], app, start, offset - start
+                }
+                app = ""
+            }
+            /^[a-zA-Z0-9_-]+:$/ {
+                flush()
+                app = substr($0, 1, length($0) - 1)
+                start = offset + 0
+                alias_list = ""
+            }
+            /^[^ \t]/ && !/^[a-zA-Z0-9_-]+:$/ { flush() }
+            app != "" && /^[ \t]+aliases:/ {
+                alias_list = $0
+                sub(/^[ \t]+aliases:[ \t]*/, "", alias_list)
+                if (alias_list ~ /^\[[^]]*\]$/) alias_list = substr(alias_list, 2, length(alias_list) - 2)
+            }
+            { offset += length($0) + 1 }
+            END { flush() }
+        ' "$yaml_file" | LC_ALL=C sort -s -t$'\t' -k1,1
+    } > "$temp_file" && chmod 644 "$temp_file" && mv -f "$temp_file" "$output" || {
+        rm -f "$temp_file"
+        return 1
+    }
+}
+
+# Check that the key index belongs to the current database
+# Compares the size in its header and that it isn't older than the database
+key_index_valid() {
+    local header
+    
+    [[ -f "$KEYS_FILE" && ! "$CONFIG_FILE" -nt "$KEYS_FILE" ]] || return 1
+    IFS= read -r header < "$KEYS_FILE" || return 1
+    [[ "$header" == "# appfetch-keys v$KEYS_VERSION $(stat -c %s "$CONFIG_FILE") "* ]]
+}
+
+# Print the key index lines for a key, by binary search on byte offsets
+# Uses look(1) when installed, otherwise probes the file with tail, so only
+# a couple of lines are read per step whatever the size of the index
+lookup_key() {
+    local key="$1"
+    local LC_ALL=C
+    local low=0 high mid pos skipped line
+    
+    if command -v look >/dev/null 2>&1; then
+        look -t $'\t' "$key"$'\t' "$KEYS_FILE"
+        return 0
+    fi
+    
+    # Invariant: low is a line start, lines before it sort before the key,
+    # and lines starting at or after high don't
+    high=$(stat -c %s "$KEYS_FILE")
+    while (( low < high )); do
+        mid=$(( (low + high) / 2 ))
+        
+        # Find the first line starting at or after mid
+        if (( mid == 0 )); then
+            pos=0
+            IFS= read -r line < "$KEYS_FILE" || line=""
+        else
+            { IFS= read -r skipped; IFS= read -r line || line=""; } < <(tail -c +"$mid" "$KEYS_FILE")
+            pos=$(( mid + ${#skipped} ))
+        fi
+        
+        if (( pos >= high )) || [[ -z "$line" ]]; then
+            high=$mid
+        elif [[ "${line%%$'\t'*}" < "$key" || "$line" == "#"* ]]; then
+            low=$(( pos + ${#line} + 1 ))
+        else
+            high=$pos
+        fi
+    done
+    
+    while IFS= read -r line && [[ "${line%%$'\t'*}" == "$key" ]]; do
+        echo "$line"
+    done < <(tail -c +"$(( low + 1 ))" "$KEYS_FILE")
+}
+
+# Send one request to appfetchd and print the lines of its reply
+# Fails with 1 when no daemon answers, so callers fall back to the database,
+# and with 2 when the daemon doesn't know the name
+# Usage: daemon_request command args...
+daemon_request() {
+    local request reply
+    
+    [[ -S "$DAEMON_SOCKET" ]] || return 1
+    request=$(IFS=$'\t'; echo "$*")
+    
+    if command -v socat > /dev/null; then
+        reply=$(socat -t 5 - "UNIX-CONNECT:$DAEMON_SOCKET" <<< "$request" 2>/dev/null) || return 1
+    elif command -v nc > /dev/null; then
+        reply=$(nc -U -w 5 "$DAEMON_SOCKET" <<< "$request" 2>/dev/null) || return 1
+    else
+        return 1
+    fi
+    
+    case "${reply%%$'\n'*}" in
+        ok)
+            [[ $reply == *$'\n'* ]] && echo "${reply#*$'\n'}"
+            return 0
+            ;;
+        missing)
+            return 2
+            ;;
+        *)
+            return 1
+            ;;
+    esac
+}
+
+# Load the entries of the given apps or aliases from appfetchd, the same
+# arrays load_config_for fills from the key index
+load_entries_from_daemon() {
+    local input reply app field value
+    
+    YAML_DATA=()
+    ALIAS_INDEX=()
+    
+    for input in "$@"; do
+        reply=$(daemon_request entry "$input") || return 1
+        app="${reply%%$'\n'*}"
+        [[ "$app" != "$input" ]] && ALIAS_INDEX["$input"]="$app"
+        [[ $reply == *$'\n'* ]] || continue
+        while IFS=$'\t' read -r field value; do
+            YAML_DATA["$app:$field"]="$value"
+        done <<< "${reply#*$'\n'}"
+    done
+    
+    build_package_index
+}
+
+# Load only the entries of the given apps or aliases, from appfetchd when it
+# is running, otherwise via the key index. Falls back to load_config when
+# there is no current key index, when loading everything is cheaper, or when
+# a name is missing from the index, so the result is always enough to resolve
+# those names
+load_config_for() {
+    local input line key app offset length package
+    local -A loaded=()
+    
+    [[ $CONFIG_LOADED == true ]] && return 0
+    load_entries_from_daemon "$@" && return 0
+    if ! key_index_valid ||
+       { [[ -f "$INDEX_FILE" && ! "$CONFIG_FILE" -nt "$INDEX_FILE" ]] &&
+         (( $# * KEYS_LOOKUP_BYTES >= $(stat -c %s "$CONFIG_FILE") )); }; then
+        load_config
+        return
+    fi
+    
+    YAML_DATA=()
+    ALIAS_INDEX=()
+    PACKAGE_INDEX=()
+    
+    for input in "$@"; do
+        line=$(lookup_key "$input")
+        if [[ -z "$line" ]]; then
+            load_config
+            return
+        fi
+        
+        while IFS=$'\t' read -r key app offset length; do
+            if [[ "$app" != "$input" && ( -z "${ALIAS_INDEX[$input]:-}" || "$app" < "${ALIAS_INDEX[$input]}" ) ]]; then
+                ALIAS_INDEX["$input"]="$app"
+            fi
+            [[ -n "${loaded[$app:$offset]:-}" ]] && continue
+            loaded["$app:$offset"]=1
+            parse_yaml_lines YAML_DATA < <(tail -c +"$(( offset + 1 ))" "$CONFIG_FILE" | head -c "$length")
+        done <<< "$line"
+    done
+    
+    # A name is also an app, it wins over an alias of another app
+    for input in "$@"; do
+        app_exists "$input" && unset 'ALIAS_INDEX[$input]'
+    done
+    
+    for key in "${!YAML_DATA[@]}"; do
+        [[ $key == *":snap" || $key == *":flatpak" ]] || continue
+        app="${key%:*}"
+        package="${key##*:}:${YAML_DATA[$key]}"
+        if [[ -z "${PACKAGE_INDEX[$package]:-}" || "$app" < "${PACKAGE_INDEX[$package]}" ]]; then
+            PACKAGE_INDEX["$package"]="$app"
+        fi
+    done
 }
 
 # Get value for app:field combination
@@ -101,51 +534,171 @@ resolve_app_name() {
     fi
     
     # Try alias match
+    if [[ -n "${ALIAS_INDEX[$input]:-}" ]]; then
+        echo "${ALIAS_INDEX[$input]}"
+        return 0
+    fi
+    
+    return 1
+}
+
+# Split text into lowercase alphanumeric words, stored in SEARCH_WORDS
+split_words() {
+    local text="${1,,}"
+    read -ra SEARCH_WORDS <<< "${text//[^a-z0-9]/ }"
+}
+
+# Build the inverted word index and the trigram index over its words
+build_search_index() {
+    local key app word gram padded i
+    local -A best grams
+    
+    unset SEARCH_TOKENS SEARCH_TRIGRAMS
+    declare -gA SEARCH_TOKENS SEARCH_TRIGRAMS
+    
     for key in "${!YAML_DATA[@]}"; do
-        if [[ $key == *":aliases" ]]; then
-            local app="${key%:*}"
-            local aliases="${YAML_DATA[$key]}"
+        [[ $key == *":comment" ]] || continue
+        app="${key%:*}"
+        best=()
+        
+        # Later fields overwrite earlier ones, so each word keeps its best weight
+        split_words "${YAML_DATA[$key]}"
+        for word in "${SEARCH_WORDS[@]}"; do
+            (( ${#word} > 1 )) || continue
+            [[ -n "${SEARCH_STOPWORDS[$word]:-}" ]] && continue
+            best["$word"]=$WEIGHT_COMMENT
+        done
+        
+        split_words "${YAML_DATA["$app:aliases"]:-}"
+        for word in "${SEARCH_WORDS[@]}"; do
+            best["$word"]=$WEIGHT_ALIAS
+        done
+        
+        split_words "$app"
+        for word in "${SEARCH_WORDS[@]}"; do
+            best["$word"]=$WEIGHT_NAME
+        done
+        
+        for word in "${!best[@]}"; do
+            SEARCH_TOKENS["$word"]+="$app:${best[$word]} "
+        done
+    done
+    
+    for word in "${!SEARCH_TOKENS[@]}"; do
+        padded="^^$word\$"
+        grams=()
+        for (( i = 0; i < ${#padded} - 2; i++ )); do
+            grams["${padded:i:3}"]=1
+        done
+        for gram in "${!grams[@]}"; do
+            SEARCH_TRIGRAMS["$gram"]+="$word "
+        done
+    done
+}
+
+# Load the search index through its own compiled index file
+load_search_index() {
+    load_cached_index "$SEARCH_INDEX_FILE" build_search_index SEARCH_TOKENS SEARCH_TRIGRAMS
+}
+
+# Score every app against one query into the SEARCH_SCORES array
+# Words are matched by trigram similarity, so exact words, prefixes and
+# typos all go through the same lookup and are weighted by how close they are
+score_query() {
+    local query="$1"
+    local term gram word entry app score padded i
+    local -A grams shared best close matched
+    
+    SEARCH_SCORES=()
+    
+    # Exact name and alias hits always rank first
+    if app_exists "$query"; then
+        SEARCH_SCORES["$query"]=100000
+    fi
+    if [[ -n "${ALIAS_INDEX[$query]:-}" ]]; then
+        SEARCH_SCORES["${ALIAS_INDEX[$query]}"]=$(( ${SEARCH_SCORES["${ALIAS_INDEX[$query]}"]:-0} + 50000 ))
+    fi
+    
+    split_words "$query"
+    for term in "${SEARCH_WORDS[@]}"; do
+        padded="^^$term\$"
+        grams=()
+        for (( i = 0; i < ${#padded} - 2; i++ )); do
+            grams["${padded:i:3}"]=1
+        done
+        
+        shared=()
+        close=()
+        for gram in "${!grams[@]}"; do
+            for word in ${SEARCH_TRIGRAMS[$gram]:-}; do
+                shared["$word"]=$(( ${shared[$word]:-0} + 1 ))
+            done
+        done
+        
+        # Dice coefficient over trigram sets, a word has length + 1 trigrams
+        best=()
+        for word in "${!shared[@]}"; do
+            local similarity=$(( 200 * shared[$word] / (${#grams[@]} + ${#word} + 1) ))
+            (( similarity < FUZZY_MIN_SIMILARITY )) && continue
             
-            IFS=',' read -ra alias_array <<< "$aliases"
-            for alias in "${alias_array[@]}"; do
-                alias=$(echo "$alias" | xargs)  # trim whitespace
-                if [[ "$alias" == "$input" ]]; then
-                    echo "$app"
-                    return 0
-                fi
+            # Squaring the similarity keeps loose matches well below exact ones
+            for entry in ${SEARCH_TOKENS[$word]}; do
+                app="${entry%:*}"
+                score=$(( ${entry##*:} * similarity * similarity / 100 ))
+                (( score > ${best[$app]:-0} )) && best["$app"]=$score
+                (( similarity >= 50 )) && close["$app"]=1
             done
-        fi
+        done
+        
+        for app in "${!best[@]}"; do
+            SEARCH_SCORES["$app"]=$(( ${SEARCH_SCORES[$app]:-0} + best[$app] ))
+        done
+        for app in "${!close[@]}"; do
+            matched["$app"]=$(( ${matched[$app]:-0} + 1 ))
+        done
     done
     
-    return 1
+    # Apps closely matching more of the query's words outrank single strong hits
+    for app in "${!matched[@]}"; do
+        SEARCH_SCORES["$app"]=$(( SEARCH_SCORES[$app] * matched[$app] ))
+    done
 }
 
-# Search for apps matching query
+# Search for apps matching each query, best matches first
+# appfetchd answers with the same scores when it is running, otherwise the
+# database and search index are loaded on the first query
 search_apps() {
     local queries=("$@")
+    local query app score comment results
+    local index_loaded=false
+    declare -gA SEARCH_SCORES
     
     for query in "${queries[@]}"; do
-        local query_lower="${query,,}"
-        local found_this=false
-        
-        while IFS= read -r app; do
-            local app_lower="${app,,}"
-            local comment_lower="${YAML_DATA["$app:comment"]:-}"
-            comment_lower="${comment_lower,,}"
-            local aliases_lower="${YAML_DATA["$app:aliases"]:-}"
-            aliases_lower="${aliases_lower,,}"
-            
-            if [[ "$app_lower" == *"$query_lower"* ]] || 
-               [[ "$comment_lower" == *"$query_lower"* ]] || 
-               [[ "$aliases_lower" == *"$query_lower"* ]]; then
-                log_search "$app: ${YAML_DATA["$app:comment"]:-}"
-                found_this=true
+        if ! results=$(daemon_request search "$SEARCH_LIMIT" "$query"); then
+            if [[ $index_loaded == false ]]; then
+                load_config
+                load_search_index
+                index_loaded=true
             fi
-        done < <(get_all_apps)
+            score_query "$query"
+            results=$(
+                for app in "${!SEARCH_SCORES[@]}"; do
+                    printf '%s\t%s\t%s\n' "${SEARCH_SCORES[$app]}" "$app" "${YAML_DATA["$app:comment"]:-}"
+                done
+            )
+        fi
         
-        if [[ $found_this == false ]]; then
+        if [[ -z "$results" ]]; then
             log_error "$query: not found"
+            continue
         fi
+        
+        while IFS=$'\t' read -r score app comment; do
+            log_search "$app: $comment"
+        done < <(
+            sort -t$'\t' -k1,1nr -k2,2 <<< "$results" |
+                if (( SEARCH_LIMIT > 0 )); then head -n "$SEARCH_LIMIT"; else cat; fi
+        )
     done
 }
 
@@ -160,40 +713,73 @@ ensure_installed_file() {
     fi
 }
 
+# Load installed.yaml into INSTALLED_DATA and start this run's journal
+# Changes are applied to installed.yaml in one commit when the script exits
+load_installed_state() {
+    local key app
+    
+    ensure_installed_file
+    parse_yaml_file "$INSTALLED_FILE" INSTALLED_DATA
+    
+    INSTALLED_PACKAGES=()
+    for key in "${!INSTALLED_DATA[@]}"; do
+        [[ $key == *":method" ]] || continue
+        app="${key%:*}"
+        INSTALLED_PACKAGES["${INSTALLED_DATA[$key]}:${INSTALLED_DATA["$app:package"]:-}"]="$app"
+    done
+    
+    if [[ -z "$STATE_JOURNAL" ]]; then
+        STATE_JOURNAL=$(mktemp "${TMPDIR:-/tmp}/appfetch-state.XXXXXX")
+        trap commit_installed_state EXIT
+    fi
+}
+
+# Drop an app from the in-memory state
+forget_installed_app() {
+    local app="$1" field
+    local package_key="${INSTALLED_DATA["$app:method"]:-}:${INSTALLED_DATA["$app:package"]:-}"
+    
+    if [[ "${INSTALLED_PACKAGES[$package_key]:-}" == "$app" ]]; then
+        unset 'INSTALLED_PACKAGES[$package_key]'
+    fi
+    for field in "${STATE_FIELDS[@]}"; do
+        unset 'INSTALLED_DATA[$app:$field]'
+    done
+}
+
 # Record installed app
 record_installed_app() {
     local app="$1"
     local method="$2"  # snap, flatpak, or custom
     local package="$3" # package name or custom command
+    local duration="${4:-}" # seconds the install took
     local timestamp=$(date -Iseconds)
     
-    ensure_installed_file
+    forget_installed_app "$app"
+    INSTALLED_DATA["$app:method"]="$method"
+    INSTALLED_DATA["$app:package"]="$package"
+    INSTALLED_DATA["$app:installed_at"]="$timestamp"
+    INSTALLED_PACKAGES["$method:$package"]="$app"
     
-    # Remove existing entry if present
-    if grep -q "^$app:" "$INSTALLED_FILE" 2>/dev/null; then
-        sed -i "/^$app:/,/^[^[:space:]]/{ /^[^[:space:]]/!d; /^$app:/d; }" "$INSTALLED_FILE"
-    fi
+    printf -- '-\t%s\n' "$app" >> "$STATE_JOURNAL"
+    printf -- '+\t%s\t%s\t%s\n' \
+        "$app" method "$method" \
+        "$app" package "$package" \
+        "$app" installed_at "$timestamp" >> "$STATE_JOURNAL"
     
-    # Add new entry
-    cat >> "$INSTALLED_FILE" << EOF
-$app:
-  method: $method
-  package: $package
-  installed_at: $timestamp
-
-EOF
+    if [[ -n "$duration" ]]; then
+        INSTALLED_DATA["$app:duration"]="$duration"
+        printf -- '+\t%s\tduration\t%s\n' "$app" "$duration" >> "$STATE_JOURNAL"
+    fi
 }
 
-# Get installed app info using the same parser
+# Get installed app info from the loaded state
 get_installed_app_info() {
     local app="$1"
     
-    ensure_installed_file
-    parse_yaml_file "$INSTALLED_FILE"
-    
-    local method=$(get_app_field "$app" "method")
-    local package=$(get_app_field "$app" "package")
-    local installed_at=$(get_app_field "$app" "installed_at")
+    local method="${INSTALLED_DATA["$app:method"]:-}"
+    local package="${INSTALLED_DATA["$app:package"]:-}"
+    local installed_at="${INSTALLED_DATA["$app:installed_at"]:-}"
     
     if [[ -n "$method" && -n "$package" ]]; then
         echo "$method§$package§$installed_at"
@@ -207,69 +793,132 @@ get_installed_app_info() {
 remove_from_installed() {
     local app="$1"
     
-    ensure_installed_file
+    forget_installed_app "$app"
+    printf -- '-\t%s\n' "$app" >> "$STATE_JOURNAL"
+}
+
+# Append an install/remove attempt to HISTORY_FILE
+# Usage: record_history install|remove app method status duration_us
+record_history() {
+    local action="$1" app="$2" method="$3" status="$4" seconds result=ok
+    format_seconds seconds "$5"
+    (( status == 0 )) || result=failed
     
-    if grep -q "^$app:" "$INSTALLED_FILE" 2>/dev/null; then
-        # Create temp file and remove the app block
-        local temp_file=$(mktemp)
-        local in_app=false
-        
-        while IFS= read -r line || [[ -n $line ]]; do
-            if [[ $line =~ ^([a-zA-Z0-9_-]+):$ ]]; then
-                if [[ "${BASH_REMATCH[1]}" == "$app" ]]; then
-                    in_app=true
-                    continue
-                else
-                    in_app=false
-                fi
-            fi
-            
-            if [[ $in_app == true ]]; then
-                if [[ ! $line =~ ^[[:space:]] ]]; then
-                    in_app=false
-                    echo "$line" >> "$temp_file"
-                fi
-            else
-                echo "$line" >> "$temp_file"
-            fi
-        done < "$INSTALLED_FILE"
-        
-        mv "$temp_file" "$INSTALLED_FILE"
+    mkdir -p "${HISTORY_FILE%/*}"
+    printf '%s\t%s\t%s\t%s\t%s\t%s\n' \
+        "$(date -Iseconds)" "$action" "$app" "$method" "$result" "$seconds" >> "$HISTORY_FILE"
+}
+
+# Close one app's install/remove attempt: add it to the history and, when it
+# worked, update the installed state (installs keep their duration)
+# Usage: finish_attempt install|remove app method status duration_us [package]
+finish_attempt() {
+    local action="$1" app="$2" method="$3" status="$4" duration_us="$5" package="${6:-}"
+    local seconds
+    
+    record_history "$action" "$app" "$method" "$status" "$duration_us"
+    (( status == 0 )) || return 0
+    
+    if [[ $action == install ]]; then
+        format_seconds seconds "$duration_us"
+        record_installed_app "$app" "$method" "$package" "$seconds"
+    else
+        remove_from_installed "$app"
     fi
 }
 
-# List installed apps
-# List installed apps
-list_installed_apps() {
-    ensure_installed_file
+# Write INSTALLED_DATA out in installed.yaml format
+write_installed_state() {
+    local key app field
+    local apps=()
     
-    if [[ ! -s "$INSTALLED_FILE" ]]; then
-        log_info "No apps installed via appfetch yet"
+    for key in "${!INSTALLED_DATA[@]}"; do
+        [[ $key == *":method" ]] && apps+=("${key%:*}")
+    done
+    (( ${#apps[@]} == 0 )) && return 0
+    
+    while IFS= read -r app; do
+        echo "$app:"
+        for field in "${STATE_FIELDS[@]}"; do
+            if [[ -n "${INSTALLED_DATA["$app:$field"]:-}" ]]; then
+                echo "  $field: ${INSTALLED_DATA["$app:$field"]}"
+            fi
+        done
+        echo
+    done < <(printf '%s\n' "${apps[@]}" | sort)
+}
+
+# Apply this run's journal to installed.yaml in one atomic write
+# The file is re-read under a lock so overlapping runs don't lose entries
+commit_installed_state() {
+    [[ -n "$STATE_JOURNAL" ]] || return 0
+    if [[ ! -s "$STATE_JOURNAL" ]]; then
+        rm -f "$STATE_JOURNAL"
         return 0
     fi
     
-    echo "📦 Apps installed via appfetch:"
-    echo
+    local lock_fd op app field value temp_file
+    ensure_installed_file
+    exec {lock_fd}>>"$INSTALLED_FILE.lock"
+    flock -x "$lock_fd"
+    
+    parse_yaml_file "$INSTALLED_FILE" INSTALLED_DATA
+    while IFS=$'\t' read -r op app field value; do
+        case "$op" in
+            -) forget_installed_app "$app" ;;
+            +) INSTALLED_DATA["$app:$field"]="$value" ;;
+        esac
+    done < "$STATE_JOURNAL"
     
-    parse_yaml_file "$INSTALLED_FILE"
+    temp_file=$(mktemp "$INSTALLED_FILE.XXXXXX")
+    chmod --reference="$INSTALLED_FILE" "$temp_file"
+    if write_installed_state > "$temp_file"; then
+        mv -f "$temp_file" "$INSTALLED_FILE"
+    else
+        rm -f "$temp_file"
+        log_error "Failed to save installed apps to $INSTALLED_FILE"
+    fi
+    
+    exec {lock_fd}>&-
+    rm -f "$STATE_JOURNAL"
+    STATE_JOURNAL=""
+}
+
+# List installed apps, checked against what snap and flatpak really have
+list_installed_apps() {
+    load_installed_state
+    load_inventory
     
     # Get apps from installed file (look for any key, not just :comment)
     local apps=()
-    for key in "${!YAML_DATA[@]}"; do
+    for key in "${!INSTALLED_DATA[@]}"; do
         if [[ $key == *":method" ]]; then  # Use :method instead of :comment
             apps+=("${key%:*}")
         fi
     done
     
+    if (( ${#apps[@]} == 0 )); then
+        log_info "No apps installed via appfetch yet"
+        list_other_installed_apps
+        return 0
+    fi
+    
+    echo "📦 Apps installed via appfetch:"
+    echo
+    
     # Sort and process apps
     while IFS= read -r app; do
-        local method=$(get_app_field "$app" "method")
-        local package=$(get_app_field "$app" "package")
+        local method="${INSTALLED_DATA["$app:method"]}"
+        local package="${INSTALLED_DATA["$app:package"]:-}"
         
         # Format based on method
         case "$method" in
             snap|flatpak)
-                printf "  %-20s %s\n" "$app" "$method"
+                if check_package_manager "$method" && [[ -z "${INVENTORY["$method:$package"]:-}" ]]; then
+                    printf "  %-20s %s (not installed anymore)\n" "$app" "$method"
+                else
+                    printf "  %-20s %s\n" "$app" "$method"
+                fi
                 ;;
             custom)
                 if [[ ${#package} -gt 60 ]]; then
@@ -282,6 +931,86 @@ list_installed_apps() {
                 ;;
         esac
     done < <(printf '%s\n' "${apps[@]}" | sort -u)
+    
+    list_other_installed_apps
+}
+
+# List apps from the database that snap or flatpak has but appfetch didn't install
+list_other_installed_apps() {
+    local key app others=()
+    
+    load_config
+    for key in "${!INVENTORY[@]}"; do
+        app="${PACKAGE_INDEX[$key]:-}"
+        if [[ -n "$app" && -z "${INSTALLED_DATA["$app:method"]:-}" ]]; then
+            others+=("$app ${key%%:*}")
+        fi
+    done
+    (( ${#others[@]} == 0 )) && return 0
+    
+    echo
+    echo "📦 Also installed, not via appfetch:"
+    echo
+    while read -r app method; do
+        printf "  %-20s %s\n" "$app" "$method"
+    done < <(printf '%s\n' "${others[@]}" | sort -u)
+}
+
+# Show the slowest installs and failure rates from HISTORY_FILE
+show_stats() {
+    local limit=10
+    local app method avg last count month action total failed
+    
+    if [[ ! -s "$HISTORY_FILE" ]]; then
+        log_info "No install history yet"
+        return 0
+    fi
+    
+    echo "🐢 Slowest installs (average of successful installs):"
+    echo
+    while IFS=$'\t' read -r app method avg last count; do
+        printf "  %-24s %-8s %8ss avg %8ss last  %3d installs\n" "$app" "$method" "$avg" "$last" "$count"
+    done < <(
+        awk -F'\t' '$2 == "install" && $5 == "ok" {
+                sum[$3] += $6; count[$3]++; last[$3] = $6; method[$3] = $4
+            }
+            END {
+                for (app in count)
+                    printf "%s\t%s\t%.1f\t%.1f\t%d\n", app, method[app], sum[app] / count[app], last[app], count[app]
+            }' "$HISTORY_FILE" | sort -t$'\t' -k3,3nr | head -n "$limit"
+    )
+    
+    echo
+    echo "📉 Failure rate by month:"
+    echo
+    while IFS=$'\t' read -r month action total failed; do
+        printf "  %-8s %-8s %5d attempts %5d failed (%d%%)\n" "$month" "$action" "$total" "$failed" $(( 100 * failed / total ))
+    done < <(
+        awk -F'\t' '{
+                key = substr($1, 1, 7) "\t" $2
+                total[key]++
+                if ($5 == "failed") failed[key]++
+            }
+            END {
+                for (key in total) printf "%s\t%d\t%d\n", key, total[key], failed[key]
+            }' "$HISTORY_FILE" | sort
+    )
+    
+    local failures
+    failures=$(
+        awk -F'\t' '{ total[$3]++; if ($5 == "failed") failed[$3]++ }
+            END {
+                for (app in failed) printf "%s\t%d\t%d\n", app, failed[app], total[app]
+            }' "$HISTORY_FILE" | sort -t$'\t' -k2,2nr -k1,1 | head -n "$limit"
+    )
+    if [[ -n "$failures" ]]; then
+        echo
+        echo "❌ Most failed apps:"
+        echo
+        while IFS=$'\t' read -r app failed total; do
+            printf "  %-24s %3d of %3d attempts failed\n" "$app" "$failed" "$total"
+        done <<< "$failures"
+    fi
 }
 
 
@@ -298,16 +1027,30 @@ validate_config() {
     fi
 }
 
-# Check if package manager is available and working
-check_package_manager() {
-    case "$1" in
+# Ask the package manager whether a package is installed right now, for
+# decisions the inventory snapshot, up to INVENTORY_TTL old, mustn't make alone
+package_installed() {
+    local manager="$1" package="$2"
+    
+    case "$manager" in
         snap)
-            command -v snap >/dev/null 2>&1 || return 1
-            snap list >/dev/null 2>&1 || return 1
+            snap list "$package" >/dev/null 2>&1
             ;;
         flatpak)
-            command -v flatpak >/dev/null 2>&1 || return 1
-            flatpak list >/dev/null 2>&1 || return 1
+            flatpak info "$package" >/dev/null 2>&1
+            ;;
+        *)
+            return 1
+            ;;
+    esac
+}
+
+# Check if package manager is available and working
+check_package_manager() {
+    case "$1" in
+        snap|flatpak)
+            load_inventory
+            [[ "${INVENTORY_OK[$1]:-}" == true ]]
             ;;
         *)
             return 0
@@ -315,34 +1058,442 @@ check_package_manager() {
     esac
 }
 
+# Ask one package manager what it has installed, adding it to INVENTORY
+# A manager that is missing or fails to answer is left out of INVENTORY_OK
+take_inventory() {
+    local manager="$1" output package _
+    
+    command -v "$manager" >/dev/null 2>&1 || return 0
+    case "$manager" in
+        snap)
+            output=$(snap list 2>/dev/null) || return 0
+            ;;
+        flatpak)
+            output=$(flatpak list --app --columns=application 2>/dev/null) || return 0
+            ;;
+    esac
+    
+    INVENTORY_OK[$manager]=true
+    while read -r package _; do
+        # Skip the table headers
+        [[ -z "$package" || "$package" == Name || "$package" == Application ]] && continue
+        INVENTORY["$manager:$package"]=1
+    done <<< "$output"
+}
+
+# Write INVENTORY to INVENTORY_FILE: a line per working manager, then
+# "manager<TAB>package" per installed package
+save_inventory() {
+    local manager key temp_file
+    
+    mkdir -p "${INVENTORY_FILE%/*}"
+    temp_file=$(mktemp "$INVENTORY_FILE.XXXXXX")
+    {
+        for manager in "${!INVENTORY_OK[@]}"; do
+            echo "$manager"
+        done
+        for key in "${!INVENTORY[@]}"; do
+            printf '%s\t%s\n' "${key%%:*}" "${key#*:}"
+        done
+    } > "$temp_file"
+    mv -f "$temp_file" "$INVENTORY_FILE"
+}
+
+# Load installed snaps and flatpaks, once per run
+# The snapshot in INVENTORY_FILE is reused while younger than INVENTORY_TTL,
+# otherwise snap and flatpak are asked and the snapshot is replaced
+load_inventory() {
+    [[ $INVENTORY_LOADED == true ]] && return 0
+    local manager package mtime=0
+    
+    INVENTORY=()
+    INVENTORY_OK=()
+    INVENTORY_LOADED=true
+    
+    [[ -f "$INVENTORY_FILE" ]] && mtime=$(stat -c %Y "$INVENTORY_FILE")
+    if (( EPOCHSECONDS - mtime < INVENTORY_TTL )); then
+        while IFS=$'\t' read -r manager package; do
+            if [[ -z "$package" ]]; then
+                INVENTORY_OK[$manager]=true
+            else
+                INVENTORY["$manager:$package"]=1
+            fi
+        done < "$INVENTORY_FILE"
+        return 0
+    fi
+    
+    take_inventory snap
+    take_inventory flatpak
+    save_inventory
+}
+
+# Apply a batch's outcome to the inventory. After a failure it's unknown
+# what changed, so the snapshot is dropped and retaken by the next run
+# Usage: update_inventory manager status add|remove packages...
+update_inventory() {
+    local manager="$1" status="$2" action="$3" pkg
+    shift 3
+    
+    [[ $INVENTORY_LOADED == true ]] || return 0
+    if (( status != 0 )); then
+        rm -f "$INVENTORY_FILE"
+        INVENTORY_LOADED=false
+        return 0
+    fi
+    
+    for pkg in "$@"; do
+        if [[ $action == add ]]; then
+            INVENTORY["$manager:$pkg"]=1
+        else
+            unset 'INVENTORY[$manager:$pkg]'
+        fi
+    done
+    save_inventory
+}
+
+# Print the sha256 of a file, or of stdin
+sha256_of() {
+    local sum
+    sum=$(sha256sum "$@") || return 1
+    echo "${sum%% *}"
+}
+
+# Evict least recently used objects until the cache fits DOWNLOAD_CACHE_MAX_MB,
+# never the object given, which the caller is still using
+evict_download_cache() {
+    local keep="${1:-}"
+    local max_bytes=$(( DOWNLOAD_CACHE_MAX_MB * 1024 * 1024 ))
+    local total=0 mtime size path
+    
+    (( max_bytes > 0 )) || return 0
+    while read -r mtime size path; do
+        [[ "$path" == "$keep" ]] && continue
+        total=$(( total + size ))
+        if (( total > max_bytes )); then
+            rm -f "$path"
+        fi
+    done < <(find "$DOWNLOAD_CACHE_DIR/objects" -type f -printf '%T@ %s %p\n' | sort -rn)
+}
+
+# Download a URL into the cache objects, point its URL entry at the object
+# and print the object's hash. Jobs on this host fetching the same URL take
+# turns on its partial file, and one that waited finds the object the other
+# just cached. Runs in a subshell so the lock goes with it; logs go to stderr
+# Usage: download_object url checksum url_key
+download_object() (
+    url="$1" checksum="$2" url_key="$3"
+    objects="$DOWNLOAD_CACHE_DIR/objects" urls="$DOWNLOAD_CACHE_DIR/urls"
+    partial="$DOWNLOAD_CACHE_DIR/partial/$url_key.${HOSTNAME:-local}"
+    hash="" status=0
+    
+    mkdir -p "$objects" "$urls" "$DOWNLOAD_CACHE_DIR/partial"
+    exec 9> "$partial.lock"
+    flock 9
+    
+    if [[ -n "$checksum" ]]; then
+        hash="$checksum"
+    elif [[ "$urls/$url_key" -nt "$partial.lock" ]]; then
+        read -r hash < "$urls/$url_key"
+    fi
+    if [[ -n "$hash" && -f "$objects/$hash" ]]; then
+        log_info "Using cached download of ${url##*/}" >&2
+        echo "$hash"
+        exit 0
+    fi
+    
+    # Interrupted downloads are resumed from the partial file, unless the
+    # server can't serve ranges (curl exit 33) and it has to start over
+    log_info "Downloading $url" >&2
+    curl -fL --retry 3 -C - -o "$partial" "$url" || status=$?
+    if (( status == 33 )); then
+        rm -f "$partial"
+        status=0
+        curl -fL --retry 3 -o "$partial" "$url" || status=$?
+    fi
+    if (( status != 0 )); then
+        log_error "Failed to download $url"
+        exit 1
+    fi
+    
+    hash=$(sha256_of "$partial")
+    if [[ -n "$checksum" && "$hash" != "$checksum" ]]; then
+        log_error "Checksum mismatch for $url (expected $checksum, got $hash)"
+        rm -f "$partial"
+        exit 1
+    fi
+    
+    mv -f "$partial" "$objects/$hash"
+    printf '%s\n' "$hash" > "$urls/$url_key.$$" && mv -f "$urls/$url_key.$$" "$urls/$url_key"
+    echo "$hash"
+)
+
+# Fetch a URL through the content-addressed download cache and copy it to target
+# Objects are stored by sha256 and URLs map to the object they last produced.
+# Every write is a rename, so several machines can share the cache directory.
+# Downloads missing from the cache are taken from BUNDLE_DIR when it has them.
+# Without a target the download is only cached
+fetch_download() {
+    local url="$1" checksum="${2,,}" target="$3"
+    local url_key hash="" object="" fetched=false
+    local objects="$DOWNLOAD_CACHE_DIR/objects" urls="$DOWNLOAD_CACHE_DIR/urls"
+    
+    url_key=$(printf '%s' "$url" | sha256_of)
+    
+    if [[ -n "$checksum" ]]; then
+        hash="$checksum"
+    elif [[ -f "$urls/$url_key" && -z "$(find "$urls/$url_key" -mtime +"$DOWNLOAD_CACHE_URL_TTL_DAYS")" ]]; then
+        read -r hash < "$urls/$url_key"
+    fi
+    
+    if [[ -n "$hash" && -f "$objects/$hash" ]]; then
+        object="$objects/$hash"
+        touch "$object"
+        log_info "Using cached download of ${url##*/}"
+    elif object=$(bundle_download "$url_key" "$checksum"); then
+        log_info "Using bundled download of ${url##*/}"
+    else
+        hash=$(download_object "$url" "$checksum" "$url_key") || return 1
+        object="$objects/$hash"
+        fetched=true
+    fi
+    
+    if [[ -n "$target" ]]; then
+        mkdir -p "$(dirname "$target")"
+        cp -f "$object" "$target" || return 1
+    fi
+    
+    # Only after the copy, so a download bigger than the cache still arrives
+    [[ $fetched == true ]] && evict_download_cache "$object"
+    return 0
+}
+
+# Print the bundle's copy of a download, found like in the download cache
+# Usage: bundle_download url_key [checksum]
+bundle_download() {
+    local url_key="$1" hash="${2:-}"
+    local downloads="$BUNDLE_DIR/downloads"
+    
+    [[ -n "$BUNDLE_DIR" ]] || return 1
+    if [[ -z "$hash" && -f "$downloads/urls/$url_key" ]]; then
+        read -r hash < "$downloads/urls/$url_key"
+    fi
+    [[ -n "$hash" && -f "$downloads/objects/$hash" ]] || return 1
+    echo "$downloads/objects/$hash"
+}
+
+# Print the newest revision of a snap in a bundle, as written by snap download
+# Usage: bundle_snap dir snap
+bundle_snap() {
+    local dir="$1" snap="$2"
+    local file newest=""
+    
+    for file in "$dir/snap/${snap}"_*.snap; do
+        [[ -f "$file" ]] || continue
+        if [[ -z "$newest" || "$file" -nt "$newest" ]]; then
+            newest="$file"
+        fi
+    done
+    [[ -n "$newest" ]] || return 1
+    echo "$newest"
+}
+
+# Print the snap of a custom command that only installs a classic snap, the
+# form downloadscripts/snapcraft.py writes for them
+classic_snap_of() {
+    [[ "$1" =~ ^sudo\ snap\ install\ ([a-z0-9-]+)\ --classic$ ]] || return 1
+    echo "${BASH_REMATCH[1]}"
+}
+
+# Print the custom command to run for an app. A classic snap that is in the
+# bundle is installed from there instead of the store
+custom_command_for() {
+    local app="$1"
+    local cmd="${YAML_DATA["$app:custom"]}"
+    local snap file
+    
+    if [[ -n "$BUNDLE_DIR" ]] && snap=$(classic_snap_of "$cmd") &&
+       file=$(bundle_snap "$BUNDLE_DIR" "$snap"); then
+        printf 'sudo snap ack %q && sudo snap install %q --classic\n' "${file%.snap}.assert" "$file"
+    else
+        echo "$cmd"
+    fi
+}
+
+# Fetch the download declared by an app's download/checksum/download_to fields
+# and export its path as APPFETCH_DOWNLOADED for the custom command. Commands
+# that fetch the file themselves for older appfetch versions skip that when set
+fetch_app_download() {
+    local app="$1"
+    local url="${YAML_DATA["$app:download"]:-}"
+    unset APPFETCH_DOWNLOADED
+    [[ -z "$url" ]] && return 0
+    
+    local target="${YAML_DATA["$app:download_to"]:-/tmp/${url##*/}}"
+    target="${target/#\~/$HOME}"
+    target="${target//\$HOME/$HOME}"
+    
+    local start_us status=0
+    clock_us start_us
+    fetch_download "$url" "${YAML_DATA["$app:checksum"]:-}" "$target" || status=$?
+    trace_since download "$app" custom "$start_us" "$status"
+    (( status == 0 )) && export APPFETCH_DOWNLOADED="$target"
+    return "$status"
+}
+
 # Execute custom command with error handling
 execute_custom_command() {
     local app="$1"
     local cmd="$2"
+    local start_us now_us status=0
     
     log_info "Installing $app via custom command"
-    echo "➤ Running: $cmd"
+    clock_us start_us
+    
+    if fetch_app_download "$app"; then
+        echo "➤ Running: $cmd"
+        eval "$cmd" || status=$?
+    else
+        status=$?
+    fi
     
-    if eval "$cmd"; then
+    clock_us now_us
+    trace_span install "$app" custom "$start_us" $(( now_us - start_us )) "$status"
+    finish_attempt install "$app" custom "$status" $(( now_us - start_us )) "$cmd"
+    
+    if (( status == 0 )); then
         log_success "$app installed successfully"
-        record_installed_app "$app" "custom" "$cmd"
     else
         log_error "Failed to install $app via custom command. You can report this by typing appfetch bug."
         return 1
     fi
 }
 
+# Check whether a command takes the apt/dpkg lock
+needs_package_lock() {
+    [[ "$1" =~ (^|[^a-zA-Z0-9_-])(apt|apt-get|dpkg|gdebi)[[:space:]] ]]
+}
+
+# Check whether a command runs snap or flatpak itself
+uses_package_manager() {
+    [[ "$1" =~ (^|[^a-zA-Z0-9_.-])(snap|flatpak)[[:space:]] ]]
+}
+
+# Run one custom install with its output captured to a log, for background use
+run_custom_job() {
+    local app="$1" log_dir="$2"
+    local cmd
+    cmd=$(custom_command_for "$app")
+    local start_us now_us status=0
+    
+    clock_us start_us
+    {
+        fetch_app_download "$app" &&
+        echo "➤ Running: $cmd" &&
+        eval "$cmd"
+    } > "$log_dir/$app.log" 2>&1 < /dev/null || status=$?
+    clock_us now_us
+    
+    trace_span install "$app" custom "$start_us" $(( now_us - start_us )) "$status"
+    finish_attempt install "$app" custom "$status" $(( now_us - start_us )) "$cmd"
+    echo "$status" > "$log_dir/$app.status"
+}
+
+# Run background custom installs, at most JOBS at a time
+run_custom_jobs() {
+    local log_dir="$1"
+    shift
+    local app running=0
+    
+    for app in "$@"; do
+        if (( running >= JOBS )); then
+            wait -n || true
+            running=$((running - 1))
+        fi
+        run_custom_job "$app" "$log_dir" &
+        running=$((running + 1))
+    done
+    wait
+}
+
+# Install apps via their custom commands, failures are left in CUSTOM_FAILED
+# With JOBS > 1 commands run concurrently with captured logs, except ones
+# taking the apt/dpkg lock, which run one at a time in the foreground
+install_custom_apps() {
+    local apps=("$@")
+    local parallel=() serial=()
+    local app log_dir="" scheduler_pid=""
+    
+    CUSTOM_FAILED=()
+    
+    for app in "${apps[@]}"; do
+        if (( JOBS > 1 && ${#apps[@]} > 1 )) && ! needs_package_lock "${YAML_DATA["$app:custom"]}"; then
+            parallel+=("$app")
+        else
+            serial+=("$app")
+        fi
+    done
+    
+    if (( ${#parallel[@]} > 0 )); then
+        # Ask for the sudo password now, background jobs can't prompt for it
+        for app in "${parallel[@]}"; do
+            if [[ "${YAML_DATA["$app:custom"]}" == *sudo* ]]; then
+                sudo -v || true
+                break
+            fi
+        done
+        
+        log_dir=$(mktemp -d "${TMPDIR:-/tmp}/appfetch-logs.XXXXXX")
+        echo
+        log_info "Installing ${#parallel[@]} apps via custom commands, up to $JOBS at a time"
+        run_custom_jobs "$log_dir" "${parallel[@]}" &
+        scheduler_pid=$!
+    fi
+    
+    for app in "${serial[@]}"; do
+        echo
+        if ! execute_custom_command "$app" "$(custom_command_for "$app")"; then
+            CUSTOM_FAILED+=("$app")
+        fi
+    done
+    
+    [[ -z "$scheduler_pid" ]] && return 0
+    
+    wait "$scheduler_pid" || true
+    echo
+    local failed_logs=false
+    for app in "${parallel[@]}"; do
+        if [[ "$(cat "$log_dir/$app.status" 2>/dev/null)" == "0" ]]; then
+            log_success "$app installed successfully"
+        else
+            log_error "Failed to install $app via custom command, see $log_dir/$app.log"
+            CUSTOM_FAILED+=("$app")
+            failed_logs=true
+        fi
+    done
+    
+    if [[ $failed_logs == false ]]; then
+        rm -rf "$log_dir"
+    fi
+}
+
 # Execute custom uninstall command
 execute_custom_uninstall() {
     local app="$1"
     local cmd="$2"
     
+    local start_us now_us status=0
+    
     log_info "Uninstalling $app via custom command"
     echo "➤ Running: $cmd"
     
-    if eval "$cmd"; then
+    clock_us start_us
+    eval "$cmd" || status=$?
+    clock_us now_us
+    trace_span remove "$app" custom "$start_us" $(( now_us - start_us )) "$status"
+    finish_attempt remove "$app" custom "$status" $(( now_us - start_us ))
+    
+    if (( status == 0 )); then
         log_success "$app uninstalled successfully"
-        remove_from_installed "$app"
     else
         log_error "Failed to uninstall $app via custom command"
         return 1
@@ -355,6 +1506,11 @@ install_via_manager() {
     shift
     local packages=("$@")
     
+    if [[ -n "$BUNDLE_DIR" ]]; then
+        install_from_bundle "$manager" "${packages[@]}"
+        return
+    fi
+    
     case "$manager" in
         snap)
             log_info "Installing ${#packages[@]} snap packages: ${packages[*]}"
@@ -370,6 +1526,47 @@ install_via_manager() {
     esac
 }
 
+# Install packages from BUNDLE_DIR: bundled snaps after acknowledging their
+# assertions, the rest from the store, and flatpaks with the bundle's repo as
+# a sideload source so flatpak pulls from it instead of flathub
+install_from_bundle() {
+    local manager="$1"
+    shift
+    local pkg file status=0
+    local files=() store=()
+    
+    case "$manager" in
+        snap)
+            for pkg in "$@"; do
+                if file=$(bundle_snap "$BUNDLE_DIR" "$pkg"); then
+                    files+=("$file")
+                else
+                    store+=("$pkg")
+                fi
+            done
+            if (( ${#files[@]} > 0 )); then
+                log_info "Installing ${#files[@]} snap packages from the bundle: ${files[*]##*/}"
+                for file in "${files[@]}"; do
+                    sudo snap ack "${file%.snap}.assert" || status=$?
+                done
+                (( status == 0 )) && { sudo snap install "${files[@]}" || status=$?; }
+            fi
+            if (( ${#store[@]} > 0 )); then
+                log_warning "Not in the bundle, installing from the store: ${store[*]}"
+                sudo snap install "${store[@]}" || status=$?
+            fi
+            return "$status"
+            ;;
+        flatpak)
+            log_info "Installing $# flatpak packages from the bundle: $*"
+            flatpak install -y --sideload-repo="$BUNDLE_DIR/flatpak/.ostree/repo" flathub "$@"
+            ;;
+        *)
+            return 1
+            ;;
+    esac
+}
+
 # Remove packages via package manager
 remove_via_manager() {
     local manager="$1"
@@ -391,6 +1588,105 @@ remove_via_manager() {
     esac
 }
 
+# Keep the packages the manager knows about in VALID_PACKAGES, reporting the
+# rest. flatpak IDs are checked against the cached flathub listing, and those
+# missing from it against the live one since the cache may predate them. Snaps
+# are checked with one snap info call, which names each snap it can't find.
+# Whatever a check can't decide is kept, run_batch sorts it out
+validate_packages() {
+    local manager="$1"
+    shift
+    local pkg listing unsure=false
+    local -A known=()
+    
+    VALID_PACKAGES=("$@")
+    case "$manager" in
+        flatpak)
+            listing=$(flatpak remote-ls --cached --app --columns=application flathub 2>/dev/null) || return 0
+            while read -r pkg _; do
+                [[ -n "$pkg" ]] && known[$pkg]=1
+            done <<< "$listing"
+            for pkg in "$@"; do
+                [[ -n "${known[$pkg]:-}" ]] || unsure=true
+            done
+            if [[ $unsure == true ]]; then
+                listing=$(flatpak remote-ls --app --columns=application flathub 2>/dev/null) || return 0
+                while read -r pkg _; do
+                    [[ -n "$pkg" ]] && known[$pkg]=1
+                done <<< "$listing"
+            fi
+            (( ${#known[@]} > 0 )) || return 0
+            ;;
+        snap)
+            # Unknown snaps are the ones snap info reports, not the ones it
+            # leaves out: a failed lookup also leaves them all out
+            listing=$(snap info "$@" 2>&1 >/dev/null) || true
+            for pkg in "$@"; do
+                known[$pkg]=1
+            done
+            while read -r pkg; do
+                unset "known[$pkg]"
+            done < <(sed -n 's/.*no snap found for "\{0,1\}\([^"]*\)"\{0,1\}$/\1/p' <<< "$listing")
+            ;;
+        *)
+            return 0
+            ;;
+    esac
+    
+    VALID_PACKAGES=()
+    for pkg in "$@"; do
+        if [[ -n "${known[$pkg]:-}" ]]; then
+            VALID_PACKAGES+=("$pkg")
+        else
+            log_error "$manager has no package $pkg, check its entry in apps.yaml"
+            BATCH_FAILED+=("$pkg")
+            local app="${PACKAGE_INDEX["$manager:$pkg"]:-}"
+            [[ -n "$app" ]] && finish_attempt install "$app" "$manager" 1 0
+        fi
+    done
+}
+
+# Install or remove packages in one transaction. If it fails, the packages are
+# split in halves and retried, so the good ones still go through in a few
+# large transactions and only the broken ones end up in BATCH_FAILED
+# Usage: run_batch install|remove manager packages...
+run_batch() {
+    local action="$1" manager="$2"
+    shift 2
+    local start_us now_us status=0 pkg app half
+    
+    (( $# == 0 )) && return 0
+    
+    clock_us start_us
+    ${action}_via_manager "$manager" "$@" || status=$?
+    clock_us now_us
+    trace_span batch "$*" "$manager" "$start_us" $(( now_us - start_us )) "$status"
+    
+    if (( status != 0 && $# > 1 )); then
+        half=$(( $# / 2 ))
+        log_warning "$manager batch of $# packages failed, retrying in smaller batches"
+        update_inventory "$manager" "$status" "${action/install/add}" "$@"
+        run_batch "$action" "$manager" "${@:1:half}"
+        run_batch "$action" "$manager" "${@:half+1}"
+        return 0
+    fi
+    
+    update_inventory "$manager" "$status" "${action/install/add}" "$@"
+    (( status == 0 )) || BATCH_FAILED+=("$1")
+    
+    # One batch handles them all, so each package is credited an equal share
+    for pkg in "$@"; do
+        if [[ $action == install ]]; then
+            app="${PACKAGE_INDEX["$manager:$pkg"]:-}"
+        else
+            app="${INSTALLED_PACKAGES["$manager:$pkg"]:-}"
+        fi
+        if [[ -n "$app" ]]; then
+            finish_attempt "$action" "$app" "$manager" "$status" $(( (now_us - start_us) / $# )) "$pkg"
+        fi
+    done
+}
+
 # Process app installation queue
 process_install_queue() {
     local manager="$1"
@@ -401,24 +1697,17 @@ process_install_queue() {
         return 0
     fi
     
+    BATCH_FAILED=()
+    validate_packages "$manager" "${queue[@]}"
+    
     echo
-    if install_via_manager "$manager" "${queue[@]}"; then
+    run_batch install "$manager" "${VALID_PACKAGES[@]}"
+    
+    if (( ${#BATCH_FAILED[@]} == 0 )); then
         log_success "${manager^} packages installed successfully"
-        
-        # Record installed packages
-        for pkg in "${queue[@]}"; do
-            # Find which app this package belongs to
-            while IFS= read -r app; do
-                local app_pkg=$(get_app_field "$app" "$manager")
-                if [[ "$app_pkg" == "$pkg" ]]; then
-                    record_installed_app "$app" "$manager" "$pkg"
-                    break
-                fi
-            done < <(get_all_apps)
-        done
         return 0
     else
-        log_error "Some $manager packages failed to install. You can report this via appfetch bug"
+        log_error "These $manager packages failed to install: ${BATCH_FAILED[*]}. You can report this via appfetch bug"
         return 1
     fi
 }
@@ -434,53 +1723,117 @@ process_remove_queue() {
         return 0
     fi
     
+    BATCH_FAILED=()
     echo
-    if remove_via_manager "$manager" "${queue[@]}"; then
+    run_batch remove "$manager" "${queue[@]}"
+    
+    if (( ${#BATCH_FAILED[@]} == 0 )); then
         log_success "${manager^} packages removed successfully"
-        
-        # Remove from installed list
-        ensure_installed_file
-        parse_yaml_file "$INSTALLED_FILE"
-        
-        # Get apps from installed file
-        local installed_apps=()
-        for key in "${!YAML_DATA[@]}"; do
-            if [[ $key == *":method" ]]; then
-                installed_apps+=("${key%:*}")
-            fi
-        done
-        
-        for pkg in "${queue[@]}"; do
-            # Find apps that used this package
-            for app in "${installed_apps[@]}"; do
-                local install_method=$(get_app_field "$app" "method")
-                local install_package=$(get_app_field "$app" "package")
-                if [[ "$install_method" == "$manager" && "$install_package" == "$pkg" ]]; then
-                    remove_from_installed "$app"
-                fi
-            done
-        done
         return 0
     else
-        log_error "Some $manager packages failed to remove"
+        log_error "These $manager packages failed to remove: ${BATCH_FAILED[*]}"
         return 1
     fi
 }
 
+# Start the snap and flatpak batches of an install or remove in the
+# background, each with its output prefixed by the manager. snapd and flatpak
+# lock separately, so they can download at once. Only with JOBS > 1, otherwise
+# finish_manager_batches runs them one after the other as before
+# Usage: start_manager_batches install|remove snap_queue_name flatpak_queue_name
+start_manager_batches() {
+    local action="$1"
+    local -n snap_batch="$2" flatpak_batch="$3"
+    local manager
+    
+    BATCH_PIDS=()
+    (( JOBS > 1 && ${#snap_batch[@]} + ${#flatpak_batch[@]} > 0 )) || return 0
+    
+    # Ask for the sudo password now, a background snap batch can't prompt for it
+    if (( ${#snap_batch[@]} > 0 )); then
+        sudo -v || true
+    fi
+    
+    BATCH_STATUS_DIR=$(mktemp -d "${TMPDIR:-/tmp}/appfetch-batches.XXXXXX")
+    for manager in snap flatpak; do
+        local -n batch="${manager}_batch"
+        (( ${#batch[@]} > 0 )) || continue
+        
+        (
+            # The parent applies the outcome to the inventory once both are done
+            INVENTORY_LOADED=false
+            status=0
+            process_${action}_queue "$manager" "${batch[@]}" 2>&1 | sed -u -e '/^$/d' -e "s/^/[$manager] /" || status=$?
+            echo "$status" > "$BATCH_STATUS_DIR/$manager"
+        ) &
+        BATCH_PIDS[$manager]=$!
+    done
+}
+
+# Wait for the batches started by start_manager_batches and summarise them,
+# or run the batches now if none were started. Fails if either batch failed
+# Usage: finish_manager_batches install|remove snap_queue_name flatpak_queue_name
+finish_manager_batches() {
+    local action="$1"
+    local -n snap_batch="$2" flatpak_batch="$3"
+    local manager status result=0
+    local done_word="${action/%e/}ed"
+    
+    if (( ${#BATCH_PIDS[@]} == 0 )); then
+        process_${action}_queue snap "${snap_batch[@]}" || result=1
+        process_${action}_queue flatpak "${flatpak_batch[@]}" || result=1
+        return "$result"
+    fi
+    
+    echo
+    for manager in snap flatpak; do
+        local -n batch="${manager}_batch"
+        [[ -n "${BATCH_PIDS[$manager]:-}" ]] || continue
+        
+        wait "${BATCH_PIDS[$manager]}" || true
+        status=$(cat "$BATCH_STATUS_DIR/$manager" 2>/dev/null || echo 1)
+        update_inventory "$manager" "$status" "${action/install/add}" "${batch[@]}"
+        
+        if (( status == 0 )); then
+            log_success "$manager: ${#batch[@]} packages $done_word"
+        else
+            log_error "$manager: batch of ${#batch[@]} packages failed"
+            result=1
+        fi
+    done
+    
+    rm -rf "$BATCH_STATUS_DIR"
+    BATCH_PIDS=()
+    return "$result"
+}
+
 # Main installation logic
 install_apps() {
     local apps=("$@")
+    local custom_queue=()
     local snap_queue=()
     local flatpak_queue=()
     local failed_apps=()
+    local run_start phase_start
     
-    # Load configuration
-    parse_yaml_file "$CONFIG_FILE"
+    clock_us run_start
+    
+    # Load configuration, only the requested entries when the key index is current
+    clock_us phase_start
+    load_config_for "${apps[@]}"
+    trace_since load_config "" "" "$phase_start"
+    clock_us phase_start
+    load_installed_state
+    trace_since load_state "" "" "$phase_start"
     
     # Validate package managers upfront
     local snap_available=false
     local flatpak_available=false
     
+    clock_us phase_start
+    load_inventory
+    trace_since inventory "" "" "$phase_start"
+    
     if check_package_manager snap; then
         snap_available=true
     else
@@ -494,6 +1847,7 @@ install_apps() {
     fi
     
     # Process each app
+    clock_us phase_start
     for input in "${apps[@]}"; do
         local resolved_app
         if ! resolved_app=$(resolve_app_name "$input"); then
@@ -511,9 +1865,22 @@ install_apps() {
         local flatpak_pkg=$(get_app_field "$resolved_app" "flatpak")
         local custom_cmd=$(get_app_field "$resolved_app" "custom")
         
+        # The snapshot only nominates apps to skip, the manager confirms it
+        if [[ -z "$custom_cmd" ]]; then
+            if [[ -n "$snap_pkg" && -n "${INVENTORY["snap:$snap_pkg"]:-}" ]] &&
+               package_installed snap "$snap_pkg"; then
+                log_info "$resolved_app is already installed (snap)"
+                continue
+            elif [[ -n "$flatpak_pkg" && -n "${INVENTORY["flatpak:$flatpak_pkg"]:-}" ]] &&
+                 package_installed flatpak "$flatpak_pkg"; then
+                log_info "$resolved_app is already installed (flatpak)"
+                continue
+            fi
+        fi
+        
         # Determine best installation method
         if [[ -n "$custom_cmd" ]]; then
-            execute_custom_command "$resolved_app" "$custom_cmd"
+            custom_queue+=("$resolved_app")
         elif [[ -n "$snap_pkg" && -n "$flatpak_pkg" ]]; then
             # Both available, use preference
             if [[ "$PREFER_SNAP" == "true" && "$snap_available" == "true" ]]; then
@@ -539,18 +1906,45 @@ install_apps() {
             failed_apps+=("$input")
         fi
     done
+    trace_since plan "" "" "$phase_start"
     
     # Execute batch installations
     local install_success=true
+    local custom_after=()
     
-    if ! process_install_queue "snap" "${snap_queue[@]}"; then
-        install_success=false
+    # With the batches in the background, custom installs run alongside them,
+    # except ones that run snap or flatpak themselves, which wait for them
+    start_manager_batches install snap_queue flatpak_queue
+    if (( ${#BATCH_PIDS[@]} > 0 )); then
+        local custom_now=()
+        for app in "${custom_queue[@]}"; do
+            if uses_package_manager "${YAML_DATA["$app:custom"]}"; then
+                custom_after+=("$app")
+            else
+                custom_now+=("$app")
+            fi
+        done
+        custom_queue=("${custom_now[@]}")
+    fi
+    
+    clock_us phase_start
+    install_custom_apps "${custom_queue[@]}"
+    trace_since custom "" custom "$phase_start" $(( ${#CUSTOM_FAILED[@]} > 0 ))
+    if (( ${#CUSTOM_FAILED[@]} > 0 )); then
+        failed_apps+=("${CUSTOM_FAILED[@]}")
     fi
     
-    if ! process_install_queue "flatpak" "${flatpak_queue[@]}"; then
+    if ! finish_manager_batches install snap_queue flatpak_queue; then
         install_success=false
     fi
     
+    if (( ${#custom_after[@]} > 0 )); then
+        install_custom_apps "${custom_after[@]}"
+        if (( ${#CUSTOM_FAILED[@]} > 0 )); then
+            failed_apps+=("${CUSTOM_FAILED[@]}")
+        fi
+    fi
+    
     # Summary
     if (( ${#failed_apps[@]} > 0 )); then
         echo
@@ -558,9 +1952,312 @@ install_apps() {
         install_success=false
     fi
     
-    return $([[ $install_success == true ]] && echo 0 || echo 1)
+    local run_status=0
+    [[ $install_success == true ]] || run_status=1
+    trace_since install_apps "" "" "$run_start" "$run_status"
+    return "$run_status"
+}
+
+
+# Check whether an app is installed: snaps and flatpaks by the inventory,
+# custom installs (and apps of a manager that can't be asked) by appfetch's state
+app_is_installed() {
+    local app="$1"
+    local method="${INSTALLED_DATA["$app:method"]:-}"
+    local snap_pkg="${YAML_DATA["$app:snap"]:-}"
+    local flatpak_pkg="${YAML_DATA["$app:flatpak"]:-}"
+    
+    [[ -n "$snap_pkg" && -n "${INVENTORY["snap:$snap_pkg"]:-}" ]] && return 0
+    [[ -n "$flatpak_pkg" && -n "${INVENTORY["flatpak:$flatpak_pkg"]:-}" ]] && return 0
+    
+    case "$method" in
+        custom)
+            return 0
+            ;;
+        snap|flatpak)
+            [[ -n "${INVENTORY["$method:${INSTALLED_DATA["$app:package"]:-}"]:-}" ]] && return 0
+            check_package_manager "$method" || return 0
+            ;;
+    esac
+    return 1
+}
+
+# Print the app names a manifest lists as "- name" lines
+read_manifest() {
+    local line
+    
+    while IFS= read -r line || [[ -n $line ]]; do
+        [[ $line =~ ^[[:space:]]*-[[:space:]]*([^#[:space:]]+) ]] || continue
+        echo "${BASH_REMATCH[1]//[\"\']/}"
+    done < "$1"
+}
+
+# Print how an app gets installed, ignoring which managers work here
+preferred_method() {
+    local app="$1"
+    
+    if [[ -n "${YAML_DATA["$app:custom"]:-}" ]]; then
+        echo custom
+    elif [[ -n "${YAML_DATA["$app:snap"]:-}" && ( -z "${YAML_DATA["$app:flatpak"]:-}" || $PREFER_SNAP == true ) ]]; then
+        echo snap
+    else
+        echo flatpak
+    fi
+}
+
+# Bring the system in line with a manifest listing apps as "- name" lines:
+# install the missing ones and, with --prune, remove apps appfetch installed
+# that the manifest doesn't list. With --plan only show what would change
+apply_manifest() {
+    local manifest="" plan=false prune=false
+    local input app key run_start
+    local -A wanted=()
+    local missing=() extra=() unknown=()
+    local present=0 apply_success=true
+    
+    clock_us run_start
+    
+    while (( $# > 0 )); do
+        case "$1" in
+            --plan)
+                plan=true
+                ;;
+            --prune)
+                prune=true
+                ;;
+            *)
+                manifest="$1"
+                ;;
+        esac
+        shift
+    done
+    
+    if [[ -z "$manifest" || ! -f "$manifest" ]]; then
+        log_error "Manifest not found: ${manifest:-none given}"
+        return 1
+    fi
+    
+    load_config
+    load_installed_state
+    load_inventory
+    
+    while IFS= read -r input; do
+        if app_exists "$input"; then
+            app="$input"
+        elif [[ -n "${ALIAS_INDEX[$input]:-}" ]]; then
+            app="${ALIAS_INDEX[$input]}"
+        else
+            unknown+=("$input")
+            continue
+        fi
+        
+        [[ -n "${wanted[$app]:-}" ]] && continue
+        wanted[$app]=1
+        if app_is_installed "$app"; then
+            present=$((present + 1))
+        else
+            missing+=("$app")
+        fi
+    done < <(read_manifest "$manifest")
+    
+    if (( ${#unknown[@]} > 0 )); then
+        log_error "Not in the database: ${unknown[*]}"
+        apply_success=false
+        
+        # An unknown line may be an installed app under a name the database
+        # no longer has, so pruning could remove exactly what it asks for
+        if [[ $prune == true ]]; then
+            log_error "Not pruning while the manifest has unknown apps; fix or remove those lines first"
+            prune=false
+        fi
+    fi
+    
+    if [[ $prune == true ]]; then
+        for key in "${!INSTALLED_DATA[@]}"; do
+            [[ $key == *":method" ]] || continue
+            app="${key%:*}"
+            [[ -z "${wanted[$app]:-}" ]] && extra+=("$app")
+        done
+    fi
+    
+    echo "📋 $manifest: $present installed, ${#missing[@]} to install, ${#extra[@]} to remove"
+    for app in "${missing[@]}"; do
+        printf "  + %-20s %s\n" "$app" "$(preferred_method "$app")"
+    done
+    for app in "${extra[@]}"; do
+        printf "  - %-20s %s\n" "$app" "${INSTALLED_DATA["$app:method"]}"
+    done
+    
+    if [[ $plan == false ]]; then
+        if (( ${#missing[@]} > 0 )); then
+            install_apps "${missing[@]}" || apply_success=false
+        fi
+        if (( ${#extra[@]} > 0 )); then
+            remove_apps "${extra[@]}" || apply_success=false
+        fi
+    fi
+    
+    local run_status=0
+    [[ $apply_success == true ]] || run_status=1
+    trace_since apply "" "" "$run_start" "$run_status"
+    return "$run_status"
 }
 
+# Gather what installing apps downloads into a bundle directory, for
+# appfetch --from-bundle DIR on machines without network access:
+#   DIR/snap/        snap download files with their assertions
+#   DIR/flatpak/     an offline repo made by flatpak create-usb
+#   DIR/downloads/   custom downloads in the download cache layout
+#   DIR/manifest.yaml  every app in the bundle, for appfetch apply
+# Arguments that are files are read as manifests
+# Usage: prefetch_bundle [--to DIR] app|manifest...
+prefetch_bundle() {
+    local dir="appfetch-bundle"
+    local input app pkg file snap cmd status user_dir
+    local inputs=() bundled=() failed=()
+    local snap_apps=() flatpak_apps=() custom_apps=()
+    local -A seen=() snap_of=() flatpak_of=()
+    
+    while (( $# > 0 )); do
+        case "$1" in
+            --to)
+                if [[ -z "${2:-}" ]]; then
+                    log_error "--to requires a directory"
+                    return 1
+                fi
+                dir="$2"
+                shift 2
+                ;;
+            *)
+                if [[ -f "$1" ]]; then
+                    mapfile -t -O "${#inputs[@]}" inputs < <(read_manifest "$1")
+                else
+                    inputs+=("$1")
+                fi
+                shift
+                ;;
+        esac
+    done
+    
+    if (( ${#inputs[@]} == 0 )); then
+        log_error "Prefetch requires at least one app or manifest"
+        return 1
+    fi
+    
+    load_config
+    for input in "${inputs[@]}"; do
+        if ! app=$(resolve_app_name "$input"); then
+            log_error "$input is not in the database"
+            failed+=("$input")
+            continue
+        fi
+        [[ -n "${seen[$app]:-}" ]] && continue
+        seen[$app]=1
+        
+        case "$(preferred_method "$app")" in
+            snap)
+                snap_of[$app]="${YAML_DATA["$app:snap"]}"
+                snap_apps+=("$app")
+                ;;
+            flatpak)
+                flatpak_of[$app]="${YAML_DATA["$app:flatpak"]}"
+                flatpak_apps+=("$app")
+                ;;
+            custom)
+                cmd="${YAML_DATA["$app:custom"]}"
+                if snap=$(classic_snap_of "$cmd"); then
+                    snap_of[$app]="$snap"
+                    snap_apps+=("$app")
+                elif [[ -n "${YAML_DATA["$app:download"]:-}" ]]; then
+                    custom_apps+=("$app")
+                elif [[ "$cmd" == *://* ]]; then
+                    log_warning "$app downloads from within its custom command, installing it will still need the network"
+                    bundled+=("$app")
+                else
+                    bundled+=("$app")
+                fi
+                ;;
+        esac
+    done
+    
+    mkdir -p "$dir"
+    
+    if (( ${#snap_apps[@]} > 0 )); then
+        mkdir -p "$dir/snap"
+        for app in "${snap_apps[@]}"; do
+            pkg="${snap_of[$app]}"
+            log_info "Downloading snap $pkg"
+            if ! snap download --target-directory="$dir/snap" "$pkg" > /dev/null; then
+                log_error "Failed to download snap $pkg"
+                failed+=("$app")
+                continue
+            fi
+            
+            # Keep only the revision just downloaded
+            file=$(bundle_snap "$dir" "$pkg")
+            for snap in "$dir/snap/${pkg}"_*.snap; do
+                [[ "$snap" == "$file" ]] || rm -f "$snap" "${snap%.snap}.assert"
+            done
+            bundled+=("$app")
+        done
+    fi
+    
+    if (( ${#flatpak_apps[@]} > 0 )); then
+        # create-usb copies from an installation, so the apps go into a
+        # throwaway per-user one rather than the host's own
+        user_dir=$(mktemp -d "${TMPDIR:-/tmp}/appfetch-flatpak.XXXXXX")
+        status=0
+        log_info "Fetching ${#flatpak_apps[@]} flatpaks into a temporary installation"
+        FLATPAK_USER_DIR="$user_dir" flatpak --user remote-add --if-not-exists flathub \
+            https://dl.flathub.org/repo/flathub.flatpakrepo || status=$?
+        if (( status == 0 )); then
+            FLATPAK_USER_DIR="$user_dir" flatpak --user install -y --noninteractive flathub "${flatpak_of[@]}" || status=$?
+        fi
+        
+        if (( status == 0 )); then
+            log_info "Exporting ${#flatpak_apps[@]} flatpaks to $dir/flatpak"
+            mkdir -p "$dir/flatpak"
+            FLATPAK_USER_DIR="$user_dir" flatpak --user create-usb "$dir/flatpak" "${flatpak_of[@]}" || status=$?
+        fi
+        rm -rf "$user_dir"
+        
+        if (( status == 0 )); then
+            bundled+=("${flatpak_apps[@]}")
+        else
+            log_error "Failed to export flatpaks: ${flatpak_of[*]}"
+            failed+=("${flatpak_apps[@]}")
+        fi
+    fi
+    
+    for app in "${custom_apps[@]}"; do
+        if DOWNLOAD_CACHE_DIR="$dir/downloads" DOWNLOAD_CACHE_MAX_MB=0 \
+           fetch_download "${YAML_DATA["$app:download"]}" "${YAML_DATA["$app:checksum"]:-}" ""; then
+            bundled+=("$app")
+        else
+            failed+=("$app")
+        fi
+    done
+    
+    # Apps bundled by earlier runs stay in the manifest
+    if [[ -f "$dir/manifest.yaml" ]]; then
+        while IFS= read -r app; do
+            [[ -n "${seen[$app]:-}" ]] || bundled+=("$app")
+        done < <(read_manifest "$dir/manifest.yaml")
+    fi
+    {
+        echo "# Install with: appfetch --from-bundle DIR apply DIR/manifest.yaml"
+        if (( ${#bundled[@]} > 0 )); then
+            printf -- '- %s\n' "${bundled[@]}" | sort -u
+        fi
+    } > "$dir/manifest.yaml"
+    
+    echo
+    log_success "$dir holds ${#bundled[@]} apps ($(du -sh "$dir" | cut -f1))"
+    if (( ${#failed[@]} > 0 )); then
+        log_error "Failed to prefetch: ${failed[*]}"
+        return 1
+    fi
+}
 
 # Remove/uninstall apps
 # Remove/uninstall apps
@@ -570,17 +2267,23 @@ remove_apps() {
     local flatpak_queue=()
     local custom_apps=()
     local failed_apps=()
+    local run_start phase_start
     
-    # Load configuration for custom uninstall commands
-    parse_yaml_file "$CONFIG_FILE"
+    clock_us run_start
     
-    # Store config data before we parse installed file
-    declare -A CONFIG_DATA
-    for key in "${!YAML_DATA[@]}"; do
-        CONFIG_DATA["$key"]="${YAML_DATA[$key]}"
-    done
+    # Load configuration for custom uninstall commands
+    clock_us phase_start
+    load_config_for "${apps[@]}"
+    trace_since load_config "" "" "$phase_start"
+    clock_us phase_start
+    load_installed_state
+    trace_since load_state "" "" "$phase_start"
+    clock_us phase_start
+    load_inventory
+    trace_since inventory "" "" "$phase_start"
     
     # Process each app
+    clock_us phase_start
     for input in "${apps[@]}"; do
         local resolved_app
         if ! resolved_app=$(resolve_app_name "$input"); then
@@ -599,6 +2302,15 @@ remove_apps() {
         
         IFS='§' read -r method package installed_at <<< "$install_info"
         
+        # Removed behind appfetch's back, e.g. with snap remove. The snapshot
+        # may predate an install by another run, so the manager has the last word
+        if [[ ($method == snap || $method == flatpak) && -z "${INVENTORY["$method:$package"]:-}" ]] &&
+           check_package_manager "$method" && ! package_installed "$method" "$package"; then
+            log_warning "$resolved_app is no longer installed, forgetting it"
+            remove_from_installed "$resolved_app"
+            continue
+        fi
+        
         case "$method" in
             snap)
                 snap_queue+=("$package")
@@ -615,23 +2327,17 @@ remove_apps() {
                 ;;
         esac
     done
+    trace_since plan "" "" "$phase_start"
     
     # Execute batch removals
     local removal_success=true
     
-    if ! process_remove_queue "snap" "${snap_queue[@]}"; then
-        removal_success=false
-    fi
-    
-    if ! process_remove_queue "flatpak" "${flatpak_queue[@]}"; then
+    start_manager_batches remove snap_queue flatpak_queue
+    if ! finish_manager_batches remove snap_queue flatpak_queue; then
         removal_success=false
     fi
     
-    # Handle custom apps - restore config data first
-    for key in "${!CONFIG_DATA[@]}"; do
-        YAML_DATA["$key"]="${CONFIG_DATA[$key]}"
-    done
-    
+    # Handle custom apps
     for app in "${custom_apps[@]}"; do
         echo
         local uninstall_cmd=$(get_app_field "$app" "uninstall")
@@ -651,24 +2357,167 @@ remove_apps() {
         removal_success=false
     fi
     
-    return $([[ $removal_success == true ]] && echo 0 || echo 1)
+    local run_status=0
+    [[ $removal_success == true ]] || run_status=1
+    trace_since remove_apps "" "" "$run_start" "$run_status"
+    return "$run_status"
+}
+
+
+# Apply a published delta to a copy of the local database
+# Deltas live at UPDATE_DELTA_URL/<sha256 of the local apps.yaml>.patch and are
+# unified diffs whose first line is "# sha256: <hash of the patched file>", e.g.
+#   { echo "# sha256: $(sha256sum < new.yaml | cut -d' ' -f1)"; diff -u old.yaml new.yaml; }
+apply_database_delta() {
+    local output="$1"
+    local revision patch_file header expected
+    
+    revision=$(sha256_of "$CONFIG_FILE")
+    patch_file=$(mktemp)
+    
+    if ! curl -fs --compressed -o "$patch_file" "${UPDATE_DELTA_URL%/}/$revision.patch"; then
+        rm -f "$patch_file"
+        return 1
+    fi
+    
+    IFS= read -r header < "$patch_file" || true
+    expected="${header#\# sha256: }"
+    
+    cp "$CONFIG_FILE" "$output"
+    if [[ $expected =~ ^[0-9a-f]{64}$ ]] &&
+       patch -s -f --no-backup-if-mismatch -r - "$output" < "$patch_file" >/dev/null &&
+       [[ "$(sha256_of "$output")" == "$expected" ]]; then
+        rm -f "$patch_file"
+        return 0
+    fi
+    
+    log_warning "Delta update did not apply, downloading the full database"
+    rm -f "$patch_file"
+    return 1
+}
+
+# Install the key index published next to the database, or build it
+# locally when there is none or it doesn't match the database we got
+update_key_index() {
+    local temp_file header
+    
+    temp_file=$(mktemp "$KEYS_FILE.XXXXXX")
+    if curl -fs --compressed -o "$temp_file" "$UPDATE_URL.keys" &&
+       IFS= read -r header < "$temp_file" &&
+       [[ "$header" == "# appfetch-keys v$KEYS_VERSION $(stat -c %s "$CONFIG_FILE") $(sha256_of "$CONFIG_FILE")" ]]; then
+        chmod 644 "$temp_file"
+        mv -f "$temp_file" "$KEYS_FILE"
+        return 0
+    fi
+    
+    rm -f "$temp_file"
+    build_key_index "$CONFIG_FILE" "$KEYS_FILE"
+}
+
+# Replace the database with a downloaded copy and drop what was derived from
+# the old one. The compiled indexes are keyed on mtime and size, which a
+# same-size update without a Last-Modified can leave unchanged
+install_database() {
+    local temp_file="$1"
+    
+    chmod 644 "$temp_file"
+    mv -f "$temp_file" "$CONFIG_FILE"
+    rm -f "$INDEX_FILE" "$SEARCH_INDEX_FILE"
+    update_key_index || log_warning "Could not update $KEYS_FILE"
 }
 
+# Update the apps database
+# Uses a delta when one is published, otherwise a conditional (ETag and
+# If-Modified-Since) compressed download. The new file replaces the old one
+# with a rename, so an interrupted update never leaves a truncated database.
+update_database() {
+    local etag_file="${CONFIG_FILE%/*}/.${CONFIG_FILE##*/}.etag"
+    local temp_file status
+    
+    log_info "Updating apps database..."
+    mkdir -p "${CONFIG_FILE%/*}"
+    temp_file=$(mktemp "$CONFIG_FILE.XXXXXX")
+    
+    if [[ -n "$UPDATE_DELTA_URL" && -f "$CONFIG_FILE" ]] && apply_database_delta "$temp_file"; then
+        # The next conditional download compares against upstream's ETag and
+        # Last-Modified, so take them from the server instead of the time the
+        # delta was applied. If they can't be had, the next check downloads
+        local headers last_modified=""
+        rm -f "$etag_file"
+        if headers=$(curl -fsSI --compressed --etag-save "$etag_file.new" "$UPDATE_URL"); then
+            last_modified=$(sed -n 's/^last-modified:[[:space:]]*//Ip' <<< "$headers" | tr -d '\r')
+            [[ -s "$etag_file.new" ]] && mv -f "$etag_file.new" "$etag_file"
+        fi
+        rm -f "$etag_file.new"
+        touch -d "${last_modified:-@0}" "$temp_file" 2>/dev/null || touch -d @0 "$temp_file"
+        install_database "$temp_file"
+        log_success "Database updated successfully (delta)"
+        return 0
+    fi
+    
+    local curl_args=(-sS --compressed -R -o "$temp_file" -w '%{http_code}' --etag-save "$etag_file.new")
+    if [[ -f "$CONFIG_FILE" ]]; then
+        curl_args+=(-z "$CONFIG_FILE")
+        if [[ -s "$etag_file" ]]; then
+            curl_args+=(--etag-compare "$etag_file")
+        fi
+    fi
+    
+    status=$(curl "${curl_args[@]}" "$UPDATE_URL") || status="000"
+    
+    case "$status" in
+        304)
+            rm -f "$temp_file" "$etag_file.new"
+            log_success "Database is already up to date"
+            ;;
+        200)
+            if [[ ! -s "$temp_file" ]] || ! grep -qE '^[a-zA-Z0-9_-]+:$' "$temp_file"; then
+                rm -f "$temp_file" "$etag_file.new"
+                log_error "Downloaded database is empty or invalid, keeping the current one"
+                return 1
+            fi
+            install_database "$temp_file"
+            mv -f "$etag_file.new" "$etag_file"
+            log_success "Database updated successfully"
+            ;;
+        *)
+            rm -f "$temp_file" "$etag_file.new"
+            log_error "Failed to update database (HTTP $status)"
+            return 1
+            ;;
+    esac
+}
 
 # Show usage information
 show_usage() {
     cat << EOF
-Usage: appfetch <command> [args...]
+Usage: appfetch [-j N] [--from-bundle DIR] <command> [args...]
 
 Commands:
   appfetch search <query>...       Search for apps matching query
+           [--limit N]             Show the N best matches per query (default $SEARCH_LIMIT, 0 for all)
   appfetch <app>...                Install specified apps
   appfetch list                    List apps installed via appfetch
+  appfetch stats                   Show slowest installs and failure rates
   appfetch remove <app>...         Remove/uninstall specified apps
+  appfetch apply <manifest>        Install the manifest's apps that are missing
+           [--plan]                Only show what would be installed/removed
+           [--prune]               Also remove apps installed via appfetch that it doesn't list
+  appfetch prefetch <app|manifest>...
+                                   Download the apps into a bundle for offline installs
+           [--to DIR]              Bundle directory (default appfetch-bundle)
   appfetch update                  Update apps database
   appfetch version                 Show version information
   appfetch bug                     Report a bug or request an app
 
+Options:
+  -j, --jobs N                     Run up to N custom installs at once, alongside
+                                   the snap and flatpak batches
+  --from-bundle DIR                Install from a bundle made by appfetch prefetch
+
+Environment:
+  APPFETCH_TRACE=1                 Write timing spans as JSON lines to $TRACE_FILE
+
 Configuration:
   change this variable PREFER_SNAP=$PREFER_SNAP  if you want to prefer snap over flatpak when both available
   sudo nano /usr/local/bin/appfetch
@@ -676,6 +2525,10 @@ Configuration:
 Examples:
   appfetch search video            Search for apps with 'video' in name/comment
   appfetch vlc firefox             Install VLC and Firefox
+  appfetch -j 4 reaper joplin tuta Install three custom apps in parallel
+  appfetch apply --plan desk.yaml  Show what applying desk.yaml would change
+  appfetch prefetch --to /mnt/usb desk.yaml
+  appfetch --from-bundle /mnt/usb apply /mnt/usb/manifest.yaml
 
 EOF
 }
@@ -684,6 +2537,31 @@ EOF
 main() {
     validate_config
     
+    # Global options
+    while (( $# > 0 )); do
+        case "$1" in
+            -j|--jobs)
+                if [[ ! "${2:-}" =~ ^[1-9][0-9]*$ ]]; then
+                    log_error "$1 requires a number of jobs"
+                    exit 1
+                fi
+                JOBS="$2"
+                shift 2
+                ;;
+            --from-bundle)
+                if [[ ! -d "${2:-}" ]]; then
+                    log_error "$1 requires a bundle directory"
+                    exit 1
+                fi
+                BUNDLE_DIR=$(cd "$2" && pwd)
+                shift 2
+                ;;
+            *)
+                break
+                ;;
+        esac
+    done
+    
     if (( $# == 0 )); then
         show_usage
         exit 1
@@ -692,17 +2570,37 @@ main() {
     case "$1" in
         search)
             shift
+            local queries=()
+            while (( $# > 0 )); do
+                case "$1" in
+                    --limit)
+                        if [[ ! "${2:-}" =~ ^[0-9]+$ ]]; then
+                            log_error "--limit requires a number"
+                            exit 1
+                        fi
+                        SEARCH_LIMIT="$2"
+                        shift 2
+                        ;;
+                    *)
+                        queries+=("$1")
+                        shift
+                        ;;
+                esac
+            done
+            set -- "${queries[@]}"
             if (( $# == 0 )); then
                 log_error "Search requires at least one query"
                 show_usage
                 exit 1
             fi
-            parse_yaml_file "$CONFIG_FILE"
             search_apps "$@"
             ;;
         list)
             list_installed_apps
             ;;
+        stats)
+            show_stats
+            ;;
         remove)
             shift
             if (( $# == 0 )); then
@@ -712,14 +2610,26 @@ main() {
             fi
             remove_apps "$@"
             ;;
-        update)
-            log_info "Updating apps database..."
-            if wget -O "$HOME/Documents/apps.yaml" "https://raw.githubusercontent.com/Tsu-gu/appfetch/refs/heads/main/apps.yaml"; then
-                log_success "Database updated successfully"
-            else
-                log_error "Failed to update database"
+        apply)
+            shift
+            if (( $# == 0 )); then
+                log_error "Apply requires a manifest"
+                show_usage
                 exit 1
             fi
+            apply_manifest "$@"
+            ;;
+        prefetch)
+            shift
+            if (( $# == 0 )); then
+                log_error "Prefetch requires at least one app or manifest"
+                show_usage
+                exit 1
+            fi
+            prefetch_bundle "$@"
+            ;;
+        update)
+            update_database || exit 1
             ;;
         version)
             echo "appfetch version 25.5.2025"
@@ -734,4 +2644,7 @@ main() {
     esac
 }
 
-main "$@"
+# Only run when executed, so the functions can be sourced (see benchmarks/)
+if [[ "${BASH_SOURCE[0]}" == "$0" ]]; then
+    main "$@"
+fi
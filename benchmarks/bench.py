@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+"""Time appfetch and the apps.yaml scripts against synthetic databases
+
+Every bash measurement runs in a fresh shell that sources appfetch.sh with
+snap, flatpak, sudo, curl and wget replaced by stubs and HOME pointed at a
+scratch directory, so nothing is installed and nothing touches the network.
+Results are written as JSON; pass an earlier result with --compare to see
+how a revision moved.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from generate_apps import generate_entries, write_apps_yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'downloadscripts'))
+
+import appsyaml
+
+APPFETCH = os.path.join(ROOT, 'appfetch.sh')
+
+STUBS = {
+    # Package managers accept everything and report nothing installed
+    'snap': '#!/bin/sh\nexit 0\n',
+    'flatpak': '#!/bin/sh\nexit 0\n',
+    'sudo': '#!/bin/sh\n[ "$1" = "-v" ] && exit 0\nexec "$@"\n',
+    # No network
+    'curl': '#!/bin/sh\nexit 7\n',
+    'wget': '#!/bin/sh\nexit 4\n',
+}
+
+# Each bash benchmark: (name, setup, timed code). Setup runs in the same
+# shell before the clock starts. $SAMPLE holds app names and aliases to look up.
+BASH_BENCHMARKS = [
+    ('parse_yaml_file', '',
+     'parse_yaml_file "$CONFIG_FILE"'),
+    ('load_config_cold', 'rm -f "$INDEX_FILE"',
+     'load_config'),
+    ('load_config_warm', '( load_config )',
+     'load_config'),
+    ('resolve_app_name', 'load_config',
+     'for name in $SAMPLE; do resolved=$(resolve_app_name "$name") || true; done'),
+    ('lookup_key', '( load_config )',
+     'for name in $SAMPLE; do lookup_key "$name"; done'),
+    ('search_cold', 'load_config; rm -f "$SEARCH_INDEX_FILE"',
+     'search_apps "$QUERY"'),
+    ('search_warm', 'load_config; ( load_search_index )',
+     'search_apps "$QUERY"'),
+    ('install_plan', '( load_config ); rm -f "$INSTALLED_FILE"',
+     'install_apps $INSTALL'),
+]
+
+def make_stubs(directory):
+    """Write the stub commands and return the directory"""
+    os.makedirs(directory, exist_ok=True)
+    for name, body in STUBS.items():
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(body)
+        os.chmod(path, 0o755)
+    return directory
+
+def pick_samples(size, seed):
+    """Names, aliases and misses to resolve, a search query and apps to install"""
+    rng = random.Random(seed)
+    entries = list(generate_entries(size, seed))
+    chosen = rng.sample(entries, min(100, len(entries)))
+    
+    sample = [name for name, _ in chosen[:80]]
+    sample += [fields['aliases'].strip('[]') for _, fields in entries if 'aliases' in fields][:15]
+    sample += [f"missing-app-{i}" for i in range(5)]
+    
+    install = [name for name, _ in chosen[:20]]
+    query = chosen[0][1]['comment'].split()[0].lower()
+    return sample, query, install
+
+def run_bash(name, setup, code, env):
+    """Run one timed bash benchmark and return the elapsed seconds"""
+    script = f'''
+source "$APPFETCH"
+{setup}
+exec 3>&1 >/dev/null 2>&1
+start=$EPOCHREALTIME
+{code}
+end=$EPOCHREALTIME
+echo "$start $end" >&3
+'''
+    result = subprocess.run(['bash', '-c', script], env=env, capture_output=True, text=True)
+    lines = result.stdout.split()
+    if result.returncode != 0 or len(lines) != 2:
+        raise RuntimeError(f"{name} failed ({result.returncode}): {result.stderr.strip()[-500:]}")
+    start, end = (float(value) for value in lines)
+    return end - start
+
+def time_python(fn, repeat):
+    """Run fn repeat times and return the elapsed seconds of each run"""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+def python_benchmarks(yaml_path, scratch, seed):
+    """The apps.yaml scripts' load and patch paths"""
+    def load():
+        with contextlib.redirect_stdout(io.StringIO()):
+            appsyaml.load_apps_yaml_safe(yaml_path)
+    
+    def patch():
+        document = appsyaml.parse(yaml_path)
+        patcher = appsyaml.Patcher(document)
+        snaps = [name for name, entry in document.entries.items() if 'snap' in entry.fields]
+        for name in random.Random(seed).sample(snaps, min(100, len(snaps))):
+            patcher.replace_field(name, 'snap', {
+                'custom': f"sudo snap install {name} --classic",
+                'uninstall': f"sudo snap remove {name}"
+            })
+        patcher.write(os.path.join(scratch, 'patched.yaml'))
+    
+    return [
+        ('appsyaml.parse', lambda: appsyaml.parse(yaml_path)),
+        ('load_apps_yaml_safe', load),
+        ('patch_100_fields', patch),
+    ]
+
+def bench_size(size, repeat, seed, workdir):
+    """Run every benchmark against a synthetic database of size entries"""
+    home = os.path.join(workdir, f"home-{size}")
+    shutil.rmtree(home, ignore_errors=True)
+    os.makedirs(os.path.join(home, 'Documents'))
+    yaml_path = os.path.join(home, 'Documents', 'apps.yaml')
+    write_apps_yaml(yaml_path, size, seed)
+    
+    sample, query, install = pick_samples(size, seed)
+    env = {
+        'PATH': f"{make_stubs(os.path.join(workdir, 'stubs'))}:{os.environ['PATH']}",
+        'HOME': home,
+        'LANG': os.environ.get('LANG', 'C.UTF-8'),
+        'APPFETCH': APPFETCH,
+        'APPFETCH_UPDATE_URL': 'http://127.0.0.1:9/apps.yaml',
+        'SAMPLE': ' '.join(sample),
+        'QUERY': query,
+        'INSTALL': ' '.join(install),
+    }
+    
+    results = []
+    for name, setup, code in BASH_BENCHMARKS:
+        runs = [run_bash(name, setup, code, env) for _ in range(repeat)]
+        results.append(result_row(size, name, runs))
+        print(f"  {size:>7} {name:<24} {statistics.median(runs):>9.3f}s", file=sys.stderr)
+    
+    for name, fn in python_benchmarks(yaml_path, home, seed):
+        runs = time_python(fn, repeat)
+        results.append(result_row(size, name, runs))
+        print(f"  {size:>7} {name:<24} {statistics.median(runs):>9.3f}s", file=sys.stderr)
+    
+    return results
+
+def result_row(size, name, runs):
+    return {
+        'size': size,
+        'benchmark': name,
+        'median': statistics.median(runs),
+        'min': min(runs),
+        'runs': runs,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Print how each median moved against an earlier run"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    
+    previous = {(row['size'], row['benchmark']): row['median'] for row in baseline['results']}
+    print(f"\nCompared with {baseline.get('revision') or baseline_path}:", file=sys.stderr)
+    for row in results:
+        before = previous.get((row['size'], row['benchmark']))
+        if before:
+            change = 100 * (row['median'] - before) / before
+            print(f"  {row['size']:>7} {row['benchmark']:<24} {before:>9.3f}s -> "
+                  f"{row['median']:>9.3f}s ({change:+.0f}%)", file=sys.stderr)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark appfetch against synthetic apps.yaml files")
+    parser.add_argument('--sizes', default='2000,20000,200000',
+                        help="comma-separated entry counts (default: 2000,20000,200000)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark (default: 3)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument('--output', '-o', help="write JSON here instead of stdout")
+    parser.add_argument('--compare', metavar='BASELINE', help="earlier JSON output to compare with")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    workdir = tempfile.mkdtemp(prefix='appfetch-bench-')
+    
+    try:
+        results = []
+        for size in sizes:
+            results += bench_size(size, args.repeat, args.seed, workdir)
+    finally:
+        if args.keep:
+            print(f"Scratch files kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = {
+        'revision': git_revision(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'bash': subprocess.run(['bash', '-c', 'echo $BASH_VERSION'],
+                               capture_output=True, text=True).stdout.strip(),
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
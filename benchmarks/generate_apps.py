@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""Generate a synthetic apps.yaml with a realistic mix of entries"""
+
+import argparse
+import random
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'xe', 'zu', 'bra', 'cle',
+             'dro', 'fli', 'gra', 'plo', 'qua', 'stri', 'tek', 'wix', 'on', 'ar', 'el', 'ix']
+
+WORDS = ['audio', 'video', 'editor', 'player', 'manager', 'browser', 'client', 'viewer',
+         'notes', 'music', 'photo', 'image', 'chat', 'mail', 'terminal', 'code', 'game',
+         'puzzle', 'password', 'backup', 'file', 'download', 'markdown', 'calendar',
+         'weather', 'system', 'monitor', 'network', 'drawing', 'reader', 'podcast',
+         'recorder', 'converter', 'simple', 'fast', 'open', 'source', 'cross', 'platform',
+         'modern', 'lightweight', 'powerful', 'private', 'secure', 'for', 'and', 'the', 'a']
+
+# Shares of each install method, roughly those of the real apps.yaml
+MIX = [('flatpak', 0.78), ('snap', 0.12), ('both', 0.05), ('custom', 0.05)]
+ALIAS_SHARE = 0.03
+
+def make_name(rng, taken):
+    """A pronounceable app name not used yet"""
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    if rng.random() < 0.15:
+        name += '-' + rng.choice(WORDS)
+    base, n = name, 2
+    while name in taken:
+        name = f"{base}{n}"
+        n += 1
+    taken.add(name)
+    return name
+
+def make_comment(rng):
+    words = rng.sample(WORDS, rng.randint(2, 6))
+    return ' '.join(words).capitalize()
+
+def pick_method(rng):
+    roll = rng.random()
+    for method, share in MIX:
+        if roll < share:
+            return method
+        roll -= share
+    return MIX[0][0]
+
+def generate_entries(count, seed=0):
+    """Yield (name, fields) for count synthetic apps, deterministic for a seed"""
+    rng = random.Random(seed)
+    taken = set()
+    
+    for _ in range(count):
+        name = make_name(rng, taken)
+        method = pick_method(rng)
+        fields = {}
+        
+        if method == 'custom':
+            # Harmless commands, the benchmark runs them
+            fields['custom'] = f"echo installing {name} && sudo true"
+            fields['uninstall'] = f"echo removing {name}"
+        if method in ('snap', 'both'):
+            fields['snap'] = name
+        if method in ('flatpak', 'both'):
+            fields['flatpak'] = f"io.github.{name.replace('-', '_')}.{name.title().replace('-', '')}"
+        if rng.random() < ALIAS_SHARE:
+            fields['aliases'] = f"[{name}-app]"
+        fields['comment'] = make_comment(rng)
+        
+        yield name, fields
+
+def write_apps_yaml(path, count, seed=0):
+    """Write a synthetic apps.yaml with count entries"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for name, fields in generate_entries(count, seed):
+            f.write(f"{name}:\n")
+            for key, value in fields.items():
+                f.write(f"  {key}: {value}\n")
+            f.write("\n")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic apps.yaml")
+    parser.add_argument('count', type=int, help="number of entries")
+    parser.add_argument('output', nargs='?', default='apps.yaml',
+                        help="file to write (default: apps.yaml)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    write_apps_yaml(args.output, args.count, args.seed)
+    print(f"Wrote {args.count} entries to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+"""Resident apps.yaml index for appfetch, served over a unix socket
+
+appfetch parses apps.yaml in bash on every run. appfetchd loads it once,
+keeps the lookup and search indexes in memory and reloads them when the file
+changes, so resolving names and searching cost one round trip instead.
+
+Each connection carries one request: a line of tab-separated words.
+
+    ping                    number of apps and the file they come from
+    resolve NAME            the app a name or alias refers to
+    field NAME FIELD        one field of an app
+    entry NAME              the app, then "field<TAB>value" for each field
+    search LIMIT QUERY      "score<TAB>app<TAB>comment" for the best matches
+    complete PREFIX         app names and aliases starting with PREFIX
+
+The reply is "ok" followed by the result lines, "missing" when the name or
+field doesn't exist, or "error MESSAGE". Names, fields and search scores
+follow appfetch.sh's own parser and search index exactly, so answers are the
+same with or without the daemon.
+"""
+
+import argparse
+import bisect
+import os
+import re
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import appsyaml
+
+# Must match WEIGHT_*, FUZZY_MIN_SIMILARITY and SEARCH_STOPWORDS in appfetch.sh
+WEIGHT_NAME = 100
+WEIGHT_ALIAS = 80
+WEIGHT_COMMENT = 40
+FUZZY_MIN_SIMILARITY = 30
+STOPWORDS = {
+    'an', 'and', 'the', 'of', 'for', 'to', 'in', 'on', 'with',
+    'your', 'you', 'is', 'it', 'by', 'from', 'or', 'as', 'at',
+}
+
+def default_socket(yaml_path):
+    """The socket appfetch looks for next to a database"""
+    directory, name = os.path.split(yaml_path)
+    return os.path.join(directory, f".{name}.sock")
+
+def split_words(text):
+    """Lowercase alphanumeric words, as split_words in appfetch.sh"""
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+def trigrams(word):
+    """The set of trigrams of a word padded as ^^word$"""
+    padded = f"^^{word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class Index:
+    """Lookup and search indexes over one version of apps.yaml"""
+    
+    def __init__(self, text):
+        self.fields = appsyaml.shell_fields(text)
+        self.aliases = {}
+        self.tokens = {}
+        self.trigrams = {}
+    
+        for app, fields in self.fields.items():
+            # An alias shared by several apps resolves to the first by name
+            for alias in fields.get('aliases', '').split(','):
+                alias = alias.strip(appsyaml.SHELL_SPACE)
+                if alias and (alias not in self.aliases or app < self.aliases[alias]):
+                    self.aliases[alias] = app
+    
+            if 'comment' not in fields:
+                continue
+    
+            # Later fields overwrite earlier ones, so each word keeps its best weight
+            best = {}
+            for word in split_words(fields['comment']):
+                if len(word) > 1 and word not in STOPWORDS:
+                    best[word] = WEIGHT_COMMENT
+            for word in split_words(fields.get('aliases', '')):
+                best[word] = WEIGHT_ALIAS
+            for word in split_words(app):
+                best[word] = WEIGHT_NAME
+            for word, weight in best.items():
+                self.tokens.setdefault(word, {})[app] = weight
+    
+        for word in self.tokens:
+            for gram in trigrams(word):
+                self.trigrams.setdefault(gram, []).append(word)
+    
+        self.keys = sorted({app for app in self.fields if self.exists(app)} | set(self.aliases))
+    
+    def exists(self, app):
+        """Whether an app has any of the fields app_exists checks"""
+        fields = self.fields.get(app, {})
+        return any(fields.get(key) for key in ('comment', 'snap', 'flatpak', 'custom'))
+    
+    def resolve(self, name):
+        """The app a name refers to, itself before an alias, or None"""
+        if self.exists(name):
+            return name
+        return self.aliases.get(name)
+    
+    def score(self, query):
+        """{app: score} for a query, computed as score_query in appfetch.sh"""
+        scores = {}
+        matched = {}
+    
+        # Exact name and alias hits always rank first
+        if self.exists(query):
+            scores[query] = 100000
+        if query in self.aliases:
+            app = self.aliases[query]
+            scores[app] = scores.get(app, 0) + 50000
+    
+        for term in split_words(query):
+            grams = trigrams(term)
+            shared = {}
+            for gram in grams:
+                for word in self.trigrams.get(gram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+    
+            # Dice coefficient over trigram sets, a word has length + 1 trigrams
+            best = {}
+            close = set()
+            for word, count in shared.items():
+                similarity = 200 * count // (len(grams) + len(word) + 1)
+                if similarity < FUZZY_MIN_SIMILARITY:
+                    continue
+                for app, weight in self.tokens[word].items():
+                    score = weight * similarity * similarity // 100
+                    if score > best.get(app, 0):
+                        best[app] = score
+                    if similarity >= 50:
+                        close.add(app)
+    
+            for app, score in best.items():
+                scores[app] = scores.get(app, 0) + score
+            for app in close:
+                matched[app] = matched.get(app, 0) + 1
+    
+        # Apps closely matching more of the query's words outrank single strong hits
+        for app, count in matched.items():
+            scores[app] *= count
+        return scores
+    
+    def search(self, query, limit):
+        """The best matches for a query, plus any tied with the last of them.
+    
+        appfetch sorts the lines itself, so ties are ordered as in a search
+        without the daemon.
+        """
+        ranked = sorted(self.score(query).items(), key=lambda item: (-item[1], item[0]))
+        if 0 < limit < len(ranked):
+            cutoff = ranked[limit - 1][1]
+            ranked = [item for item in ranked if item[1] >= cutoff]
+        return [f"{score}\t{app}\t{self.fields[app].get('comment', '')}" for app, score in ranked]
+    
+    def complete(self, prefix):
+        """App names and aliases starting with prefix, in order"""
+        start = bisect.bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return self.keys[start:end]
+
+class Database:
+    """The index of an apps.yaml, rebuilt whenever the file is replaced or written.
+
+    mtime and size alone miss a same-size update that kept an old mtime, so
+    the inode (new on every rename over the file) and ctime are compared too.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.index = None
+        self.lock = threading.Lock()
+        self.refresh()
+    
+    def refresh(self):
+        """Reload the index if the file changed, and return the current one"""
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_ino, st.st_ctime_ns, st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self.stamp and self.index is not None:
+            return self.index
+    
+        with self.lock:
+            if stamp != self.stamp or self.index is None:
+                started = time.monotonic()
+                try:
+                    with open(self.path, 'r', encoding='utf-8', errors='surrogateescape', newline='') as f:
+                        self.index = Index(f.read())
+                except OSError as e:
+                    print(f"Cannot read {self.path}: {e}", file=sys.stderr)
+                    self.index = self.index or Index('')
+                self.stamp = stamp
+                print(f"Loaded {len(self.index.fields)} apps from {self.path} "
+                      f"in {time.monotonic() - started:.2f}s", flush=True)
+            return self.index
+
+def answer(db, words):
+    """Reply lines for one request, starting with ok, missing or error"""
+    index = db.refresh()
+    command, args = words[0], words[1:]
+    
+    if command == 'ping' and not args:
+        return ['ok', f"{len(index.fields)}\t{db.path}"]
+    if command == 'resolve' and len(args) == 1:
+        app = index.resolve(args[0])
+        return ['ok', app] if app else ['missing']
+    if command == 'field' and len(args) == 2:
+        app = index.resolve(args[0])
+        if app is None or args[1] not in index.fields[app]:
+            return ['missing']
+        return ['ok', index.fields[app][args[1]]]
+    if command == 'entry' and len(args) == 1:
+        app = index.resolve(args[0])
+        if app is None:
+            return ['missing']
+        return ['ok', app] + [f"{field}\t{value}" for field, value in index.fields[app].items()]
+    if command == 'search' and len(args) == 2 and args[0].isdigit():
+        return ['ok'] + index.search(args[1], int(args[0]))
+    if command == 'complete' and len(args) <= 1:
+        return ['ok'] + index.complete(args[0] if args else '')
+    return [f"error bad request: {' '.join(words)}"]
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answer the single request line of a connection"""
+    
+    def handle(self):
+        data = self.rfile.readline()
+        if not data:
+            # A connection closed without a request, like claim_socket's probe
+            return
+        
+        line = data.decode('utf-8', 'surrogateescape').rstrip('\r\n')
+        try:
+            reply = answer(self.server.db, line.split('\t'))
+        except Exception as e:
+            reply = [f"error {type(e).__name__}: {e}"]
+        
+        try:
+            self.wfile.write(('\n'.join(reply) + '\n').encode('utf-8', 'surrogateescape'))
+        except OSError:
+            # The client gave up waiting
+            pass
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    
+    def __init__(self, socket_path, db):
+        self.db = db
+        super().__init__(socket_path, RequestHandler)
+
+def claim_socket(socket_path):
+    """Remove a socket left by a daemon that is gone; fail if one is still running"""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        sys.exit(f"appfetchd is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+def watch(db, interval):
+    """Reload the index in the background soon after the file changes"""
+    while True:
+        time.sleep(interval)
+        db.refresh()
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Serve apps.yaml lookups and searches to appfetch over a unix socket")
+    parser.add_argument('yaml_path', nargs='?', default=os.path.expanduser('~/Documents/apps.yaml'),
+                        help="apps database to serve (default: ~/Documents/apps.yaml)")
+    parser.add_argument('--socket',
+                        help="socket to listen on (default: .apps.yaml.sock next to the database)")
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help="seconds between checks of the database for changes (default: 2)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    yaml_path = os.path.abspath(args.yaml_path)
+    socket_path = args.socket or default_socket(yaml_path)
+    
+    db = Database(yaml_path)
+    claim_socket(socket_path)
+    
+    # Only the owner may connect
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(socket_path, db)
+    finally:
+        os.umask(old_umask)
+    
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    threading.Thread(target=watch, args=(db, args.interval), daemon=True).start()
+    print(f"Listening on {socket_path}", flush=True)
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+if __name__ == "__main__":
+    main()
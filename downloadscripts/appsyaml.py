@@ -0,0 +1,378 @@
+"""Single-pass apps.yaml parser and batch patcher shared by the download scripts
+
+apps.yaml isn't strict YAML (shell commands contain ': ' and quotes), so it is
+read line by line the same way appfetch does. Every entry and field keeps the
+line and byte span it came from, which lets Patcher rewrite the file in one
+streaming pass touching only the edited lines.
+
+shell_fields and key_index_rows follow appfetch.sh's own rules instead, for
+code that must read apps.yaml exactly as appfetch does.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+
+# Must match KEYS_VERSION in appfetch.sh
+KEYS_VERSION = 1
+
+# An app header line as appfetch's parser recognises it
+APP_LINE = re.compile(rb'^[a-zA-Z0-9_-]+:$')
+ALIASES_LINE = re.compile(rb'^[ \t]+aliases:[ \t]*(.*)$')
+
+# Lines as parse_yaml_lines in appfetch.sh matches them ([[:space:]] is not \s)
+SHELL_SPACE = ' \t\n\r\f\v'
+SHELL_APP_LINE = re.compile(r'^([a-zA-Z0-9_-]+):$')
+SHELL_FIELD_LINE = re.compile(rf'^[{SHELL_SPACE}]+([a-z_]+):[{SHELL_SPACE}]*(.*)$', re.S)
+SHELL_ALIASES_VALUE = re.compile(r'^\[([^\]]*)\]$', re.S)
+
+class Field:
+    """A field of an entry: its value, the lines [start, end) and the bytes
+    [start_byte, end_byte) it spans, continuation lines included"""
+
+    def __init__(self, value, start, end, start_byte, end_byte):
+        self.value = value
+        self.start = start
+        self.end = end
+        self.start_byte = start_byte
+        self.end_byte = end_byte
+
+class Entry:
+    """A top-level app with its fields and the lines/bytes it spans"""
+
+    def __init__(self, name, start, start_byte):
+        self.name = name
+        self.start = start  # header line
+        self.end = start + 1  # first line after the entry
+        self.body_end = start + 1  # first line after the last field
+        self.start_byte = start_byte
+        self.end_byte = start_byte
+        self.fields = {}
+
+    def values(self):
+        """Field values as a plain dict"""
+        return {key: field.value for key, field in self.fields.items()}
+
+class AppsYaml:
+    """Parsed apps.yaml: original lines plus an index of entries by name"""
+
+    def __init__(self, path, lines, entries):
+        self.path = path
+        self.lines = lines
+        self.entries = entries
+        self.newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def apps(self):
+        """All entries as {name: {field: value}}"""
+        return {name: entry.values() for name, entry in self.entries.items()}
+
+def indent_of(line):
+    return len(line) - len(line.lstrip(' \t'))
+
+def parse(path):
+    """Parse apps.yaml in a single pass, recording the span of every entry and field"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        lines = f.readlines()
+    
+    entries = {}
+    entry = None
+    field = None
+    field_indent = None
+    offset = 0
+    
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        indent = indent_of(line)
+        line_end = offset + len(line.encode('utf-8'))
+        
+        if stripped and not stripped.startswith('#') and indent == 0 and ':' in line:
+            # Top-level app entry; a duplicate name replaces the earlier one, as in YAML
+            if entry:
+                entry.end_byte = offset
+            entry = Entry(line.split(':', 1)[0].strip(), i, offset)
+            entries[entry.name] = entry
+            field = None
+            field_indent = None
+        elif entry and stripped and not stripped.startswith('#'):
+            if field and indent > field_indent:
+                # Continuation of a multi-line value
+                field.value = f"{field.value} {stripped}".strip()
+                field.end = i + 1
+                field.end_byte = line_end
+            elif ':' in stripped:
+                key, value = stripped.split(':', 1)
+                field = Field(value.strip(), i, i + 1, offset, line_end)
+                field_indent = indent
+                entry.fields[key.strip()] = field
+            entry.body_end = i + 1
+        
+        offset = line_end
+        if entry:
+            entry.end = i + 1
+    
+    if entry:
+        entry.end_byte = offset
+    return AppsYaml(path, lines, entries)
+
+def load_apps_yaml_safe(yaml_path):
+    """Load apps.yaml as {name: {field: value}}, or {} if it can't be read"""
+    print(f"Loading apps.yaml from: {yaml_path}")
+    
+    if not os.path.exists(yaml_path):
+        print(f"{yaml_path} not found")
+        return {}
+    
+    try:
+        document = parse(yaml_path)
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error loading YAML: {e}")
+        return {}
+    
+    print(f"Loaded {len(document)} top-level entries")
+    return document.apps()
+
+class Patcher:
+    """Collects edits to a parsed apps.yaml and applies them in one rewrite.
+
+    Edits are keyed by the original line numbers, so any number of them cost
+    one linear pass over the file; untouched lines are copied byte for byte.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.replaced = {}  # line -> replacement lines ([] removes it)
+        self.inserted = {}  # line -> lines to write after it
+        self.appended = []
+        self.edits = 0
+
+    def _entry(self, app):
+        try:
+            return self.document.entries[app]
+        except KeyError:
+            raise KeyError(f"{app} is not in {self.document.path}") from None
+
+    def _field_line(self, entry, key, value):
+        indent = '  '
+        if entry.fields:
+            first = self.document.lines[next(iter(entry.fields.values())).start]
+            indent = first[:indent_of(first)]
+        return f"{indent}{key}: {value}{self.document.newline}"
+
+    def _replace(self, start, end, lines):
+        self.replaced[start] = lines
+        for i in range(start + 1, end):
+            self.replaced[i] = []
+        self.edits += 1
+
+    def set_field(self, app, key, value):
+        """Replace a field's value, or add the field after the entry's last one"""
+        entry = self._entry(app)
+        if key in entry.fields:
+            self.replace_field(app, key, {key: value})
+        else:
+            self.inserted.setdefault(entry.body_end - 1, []).append(self._field_line(entry, key, value))
+            self.edits += 1
+
+    def replace_field(self, app, key, fields):
+        """Replace a field, in place, with one or more {key: value} fields"""
+        entry = self._entry(app)
+        field = entry.fields[key]
+        self._replace(field.start, field.end,
+                      [self._field_line(entry, k, v) for k, v in fields.items()])
+
+    def remove_field(self, app, key):
+        """Remove a field and any continuation lines"""
+        field = self._entry(app).fields[key]
+        self._replace(field.start, field.end, [])
+
+    def remove_entry(self, app):
+        """Remove an entry including the blank lines that follow it"""
+        entry = self._entry(app)
+        self._replace(entry.start, entry.end, [])
+
+    def append_entry(self, app, fields):
+        """Add a new entry at the end of the file"""
+        newline = self.document.newline
+        lines = [f"{app}:{newline}"]
+        lines += [f"  {key}: {value}{newline}" for key, value in fields.items()]
+        self.appended.append(lines)
+        self.edits += 1
+
+    def render(self):
+        """Yield the patched file line by line"""
+        newline = self.document.newline
+        last = newline
+        for i, line in enumerate(self.document.lines):
+            for out in self.replaced.get(i, [line]) + self.inserted.get(i, []):
+                # Anything written after an unterminated last line starts a new one
+                if not last.endswith('\n'):
+                    yield newline
+                yield out
+                last = out
+        
+        if self.appended and not last.endswith('\n'):
+            yield newline
+        for entry_lines in self.appended:
+            if last.strip():
+                yield newline
+            yield from entry_lines
+            last = entry_lines[-1]
+
+    def write(self, path=None):
+        """Stream the patched file to a temp file and atomically replace the target"""
+        path = path or self.document.path
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.apps.yaml.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(self.render())
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return self.edits
+
+def shell_fields(text):
+    """{app: {field: value}} read line by line as parse_yaml_lines in appfetch.sh does"""
+    lines = text.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    
+    apps = {}
+    app = None
+    for line in lines:
+        match = SHELL_APP_LINE.match(line)
+        if match:
+            app = match.group(1)
+            apps.setdefault(app, {})
+            continue
+        
+        if app is None:
+            continue
+        match = SHELL_FIELD_LINE.match(line)
+        if match:
+            field, value = match.groups()
+            if field == 'aliases':
+                aliases = SHELL_ALIASES_VALUE.match(value)
+                if aliases:
+                    value = aliases.group(1)
+            apps[app][field] = value
+        elif not line[:1] or line[0] not in SHELL_SPACE:
+            app = None
+    return apps
+
+def key_index_rows(data):
+    """Yield (key, app, offset, length) for every app name and alias in apps.yaml bytes.
+
+    Spans run from an app's header line to the next unindented line, exactly
+    as build_key_index in appfetch.sh computes them.
+    """
+    lines = data.split(b'\n')
+    if data.endswith(b'\n'):
+        lines.pop()
+    
+    app = None
+    start = offset = 0
+    aliases = b''
+    
+    def flush():
+        yield app, app, start, offset - start
+        for alias in aliases.split(b','):
+            alias = alias.strip(b' \t')
+            if alias:
+                yield alias, app, start, offset - start
+    
+    for line in lines:
+        if APP_LINE.match(line):
+            if app is not None:
+                yield from flush()
+            app, start, aliases = line[:-1], offset, b''
+        elif line[:1] not in (b'', b' ', b'\t'):
+            if app is not None:
+                yield from flush()
+            app = None
+        elif app is not None:
+            match = ALIASES_LINE.match(line)
+            if match:
+                aliases = match.group(1)
+                if aliases.startswith(b'[') and aliases.endswith(b']') and b']' not in aliases[1:-1]:
+                    aliases = aliases[1:-1]
+        offset += len(line) + 1
+    
+    if app is not None:
+        yield from flush()
+
+def render_key_index(data):
+    """The key index file for apps.yaml bytes: a header carrying the size and
+    sha256 of the data, then one sorted "key<TAB>app<TAB>offset<TAB>length" row per key"""
+    rows = sorted(key_index_rows(data), key=lambda row: row[0])
+    header = f"# appfetch-keys v{KEYS_VERSION} {len(data)} {hashlib.sha256(data).hexdigest()}\n"
+    return header.encode() + b''.join(b'%s\t%s\t%d\t%d\n' % row for row in rows)
+
+def write_key_index(yaml_path, output=None):
+    """Write the sorted key index appfetch publishes next to apps.yaml"""
+    output = output or f"{yaml_path}.keys"
+    with open(yaml_path, 'rb') as f:
+        index = render_key_index(f.read())
+    
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, tmp_path = tempfile.mkstemp(prefix='.apps.yaml.keys.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(index)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return index.count(b'\n') - 1
+
+def check_key_index(yaml_path, keys_path=None):
+    """Return why the key index doesn't match apps.yaml, or None if it does"""
+    keys_path = keys_path or f"{yaml_path}.keys"
+    with open(yaml_path, 'rb') as f:
+        expected = render_key_index(f.read())
+    try:
+        with open(keys_path, 'rb') as f:
+            actual = f.read()
+    except FileNotFoundError:
+        return f"{keys_path} is missing"
+    
+    if actual.partition(b'\n')[0] != expected.partition(b'\n')[0]:
+        return f"{keys_path} was built from a different {yaml_path} (size or sha256 differs)"
+    if actual != expected:
+        return f"{keys_path} has the right header but different rows"
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the apps.yaml.keys index appfetch reads entries through")
+    parser.add_argument('yaml_path', nargs='?', default='apps.yaml',
+                        help="apps database to index (default: apps.yaml)")
+    parser.add_argument('--check', action='store_true',
+                        help="only check the existing index, exit 1 if it doesn't match the database")
+    args = parser.parse_args()
+    
+    if args.check:
+        problem = check_key_index(args.yaml_path)
+        if problem:
+            print(f"{problem}, regenerate it with: python3 downloadscripts/appsyaml.py {args.yaml_path}", file=sys.stderr)
+            return 1
+        print(f"{args.yaml_path}.keys is up to date")
+        return 0
+    
+    print(f"Wrote {write_key_index(args.yaml_path)} keys to {args.yaml_path}.keys")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
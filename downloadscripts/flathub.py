@@ -1,13 +1,188 @@
 #!/usr/bin/env python3
 
 import requests
+from requests.adapters import HTTPAdapter
 import subprocess
-import yaml
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import sqlite3
+import threading
+import glob
+import random
 import time
 import os
-import sys
+
+from appsyaml import load_apps_yaml_safe
+from throttle import TokenBucket, positive_float, positive_int
+
+# Status codes worth retrying after a pause
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Cache writes per SQLite transaction, the rest are committed on close
+CACHE_COMMIT_EVERY = 100
+
+class FlathubCache:
+    """Persistent per-app verification status and appstream details.
+
+    Entries older than the TTL are treated as missing, so only new or
+    expired apps are queried again. Writes are committed in batches and on
+    close. Safe to share between worker threads.
+    """
+
+    def __init__(self, path, ttl_days):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.ttl = ttl_days * 86400
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS verification (
+                app_id TEXT PRIMARY KEY,
+                verified INTEGER NOT NULL,
+                checked_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS details (
+                app_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+        """)
+
+    def get_verification(self, app_id):
+        """Return the cached verification status, None if missing or expired"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT verified FROM verification WHERE app_id = ? AND checked_at >= ?",
+                (app_id, time.time() - self.ttl)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def get_details(self, app_id):
+        """Return the cached (name, summary), None if missing or expired"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT name, summary FROM details WHERE app_id = ? AND fetched_at >= ?",
+                (app_id, time.time() - self.ttl)).fetchone()
+        return None if row is None else tuple(row)
+
+    def set_verification(self, app_id, verified):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO verification VALUES (?, ?, ?)",
+                (app_id, int(verified), time.time()))
+            self._written()
+
+    def set_details(self, app_id, name, summary):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO details VALUES (?, ?, ?, ?)",
+                (app_id, name, summary, time.time()))
+            self._written()
+
+    def _written(self):
+        """Count a write, committing once CACHE_COMMIT_EVERY are pending; call with the lock held"""
+        self.pending += 1
+        if self.pending >= CACHE_COMMIT_EVERY:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+class RunJournal:
+    """Append-only JSON-lines checkpoint of a run, read back by --resume.
+
+    Records the run's snapshot and output files, every verification result
+    and every entry written, so a resumed run repeats none of them.
+    """
+
+    def __init__(self, path, resume):
+        self.path = path
+        self.snapshot = None
+        self.output = None
+        self.checked = {}
+        self.written = {}
+        finished = False
+        
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from an interrupted run
+                    if event['event'] == 'start':
+                        self.snapshot = event['snapshot']
+                        self.output = event['output']
+                    elif event['event'] == 'verified':
+                        self.checked[event['app_id']] = event['verified']
+                    elif event['event'] == 'written':
+                        self.written[event['app_id']] = event['key']
+                    elif event['event'] == 'finished':
+                        finished = True
+        
+        # A finished run leaves nothing to resume, the next one starts over
+        if finished:
+            self.snapshot = self.output = None
+            self.checked, self.written = {}, {}
+        
+        self.file = open(path, 'a' if resume and not finished else 'w', encoding='utf-8')
+        if self.file.tell() > 0:
+            self.file.write('\n')
+        self.lock = threading.Lock()
+
+    def record(self, event, **fields):
+        with self.lock:
+            self.file.write(json.dumps({'event': event, **fields}) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def make_session(pool_size):
+    """Create a requests session keeping up to pool_size keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['accept'] = 'application/json'
+    return session
+
+def get_json(session, url, limiter, retries=5):
+    """GET a JSON document, backing off on 429/5xx and connection errors.
+
+    Returns None for any other failure, including retries running out.
+    """
+    delay = 1.0
+    
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            response = session.get(url, timeout=30)
+        except requests.RequestException:
+            response = None
+        
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            if response.status_code != 200:
+                return None
+            try:
+                return response.json()
+            except ValueError:
+                return None
+        
+        if attempt == retries:
+            break
+        
+        # Honour Retry-After when the server sends it in seconds
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        pause = float(retry_after) if retry_after.isdigit() else delay
+        time.sleep(pause + random.uniform(0, delay / 2))
+        delay = min(delay * 2, 60)
+    
+    return None
 
 def get_flathub_apps():
     """Get all Flathub apps and save to dated file"""
@@ -45,155 +220,136 @@ def get_flathub_apps():
     print(f"Saved {len(apps)} apps to {filename}")
     return apps, filename
 
-def load_apps_yaml_safe(yaml_path):
-    """Load YAML file with custom parsing to handle shell commands"""
-    print(f"Attempting to load: {yaml_path}")
-    print(f"File exists: {os.path.exists(yaml_path)}")
-    
-    if not os.path.exists(yaml_path):
-        print(f"{yaml_path} not found")
-        return {}
-    
-    print(f"File size: {os.path.getsize(yaml_path)} bytes")
-    
-    try:
-        with open(yaml_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Try standard YAML parsing first
-        try:
-            data = yaml.safe_load(content)
-            if data is not None:
-                print(f"Successfully loaded YAML with {len(data)} top-level entries")
-                return data
-        except yaml.YAMLError:
-            print("Standard YAML parsing failed, trying custom parsing...")
-        
-        # Custom parsing for your format
-        data = {}
-        current_app = None
-        
-        lines = content.split('\n')
-        i = 0
-        
-        while i < len(lines):
-            line = lines[i]
-            stripped = line.strip()
-            
-            # Skip empty lines and comments
-            if not stripped or stripped.startswith('#'):
-                i += 1
-                continue
-            
-            # Calculate indentation
-            indent = len(line) - len(line.lstrip())
-            
-            # Top-level app entry (no indentation)
-            if indent == 0 and ':' in line:
-                app_name = line.split(':')[0].strip()
-                current_app = app_name
-                data[current_app] = {}
-                i += 1
-                continue
-            
-            # Sub-entry (indented)
-            if current_app and indent > 0 and ':' in line:
-                key_value = line.strip()
-                if ':' in key_value:
-                    key = key_value.split(':', 1)[0].strip()
-                    value = key_value.split(':', 1)[1].strip()
-                    
-                    # Handle multi-line values (commands with pipes, etc.)
-                    if not value:  # Value is on next lines
-                        i += 1
-                        value_lines = []
-                        while i < len(lines):
-                            next_line = lines[i]
-                            next_indent = len(next_line) - len(next_line.lstrip())
-                            if next_indent > indent and next_line.strip():
-                                value_lines.append(next_line.strip())
-                                i += 1
-                            else:
-                                break
-                        value = ' '.join(value_lines)
-                        i -= 1  # Back up one since we'll increment at end of loop
-                    
-                    data[current_app][key] = value
-            
-            i += 1
-        
-        print(f"Custom parsing successful with {len(data)} top-level entries")
-        return data
-        
-    except Exception as e:
-        print(f"Error loading YAML: {e}")
-        return {}
+def load_snapshot(filename):
+    """Load the app IDs saved in a flathub-verified-*.txt snapshot"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
 
-def check_verification_status(app_id):
-    """Check if an app is verified"""
+def check_verification_status(app_id, session, limiter):
+    """Check if an app is verified, None if the lookup failed"""
     url = f"https://flathub.org/api/v2/verification/{app_id}/status"
     
-    try:
-        response = requests.get(url, headers={'accept': 'application/json'})
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('verified', False)
-        else:
-            return False
-    except Exception as e:
-        return False
-
-def get_app_details(app_id):
-    """Get app name and summary from appstream"""
+    data = get_json(session, url, limiter)
+    if data is None:
+        return None
+    return bool(data.get('verified', False))
+
+def get_app_details(app_id, session, limiter):
+    """Get app name and summary from appstream, None if the lookup failed"""
     url = f"https://flathub.org/api/v2/appstream/{app_id}?locale=en"
     
-    try:
-        response = requests.get(url, headers={'accept': 'application/json'})
-        if response.status_code == 200:
-            data = response.json()
-            name = data.get('name', app_id)
-            summary = data.get('summary', 'No description available')
-            return name, summary
-        else:
-            return app_id, 'No description available'
-    except Exception as e:
-        return app_id, 'No description available'
+    data = get_json(session, url, limiter)
+    if data is None:
+        return None
+    name = data.get('name', app_id)
+    summary = data.get('summary', 'No description available')
+    return name, summary
+
+def load_previous_snapshot(current_filename):
+    """Load the most recent flathub-verified-*.txt other than the current one"""
+    snapshots = sorted(f for f in glob.glob("flathub-verified-*.txt") if f != current_filename)
+    if not snapshots:
+        return set(), None
+    
+    return set(load_snapshot(snapshots[-1])), snapshots[-1]
+
+def bounded_map(executor, fn, items, max_in_flight):
+    """Yield (item, fn(item)) in completion order, pulling items lazily.
+
+    At most max_in_flight calls are pending at once, so an unbounded input
+    stream never turns into an unbounded queue of futures.
+    """
+    pending = {}
+    for item in items:
+        pending[executor.submit(fn, item)] = item
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
 
 def generate_yaml_key(app_name):
     """Generate a YAML key from app name by replacing spaces with hyphens"""
     return app_name.replace(' ', '-').lower()
 
-def save_new_verified_apps(new_apps_data, date_str):
-    """Save new verified apps to a separate file"""
-    filename = f"new_verified_flatpaks_{date_str}.yaml"
-    
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(f"# New verified Flatpak apps found on {date_str}\n")
-        f.write(f"# Total: {len(new_apps_data)} apps\n\n")
-        
-        for app_name in sorted(new_apps_data.keys()):
-            app_data = new_apps_data[app_name]
-            f.write(f"{app_name}:\n")
-            f.write(f"  flatpak: {app_data['flatpak']}\n")
-            f.write(f"  comment: {app_data['comment']}\n")
-            f.write("\n")
-    
-    print(f"Saved {len(new_apps_data)} new verified apps to {filename}")
-    return filename
+class VerifiedAppsWriter:
+    """Append new verified apps to the review file as they arrive"""
+
+    def __init__(self, filename, date_str, append):
+        self.filename = filename
+        self.count = 0
+        resuming = append and os.path.exists(filename)
+        self.file = open(filename, 'a' if resuming else 'w', encoding='utf-8')
+        if not resuming:
+            self.file.write(f"# New verified Flatpak apps found on {date_str}\n\n")
+            self.file.flush()
+
+    def write(self, yaml_key, app_id, summary):
+        self.file.write(f"{yaml_key}:\n")
+        self.file.write(f"  flatpak: {app_id}\n")
+        self.file.write(f"  comment: {summary}\n")
+        self.file.write("\n")
+        self.file.flush()
+        self.count += 1
+
+    def close(self, total):
+        self.file.write(f"# Total: {total} apps\n")
+        self.file.close()
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Find verified Flathub apps missing from apps.yaml")
+    parser.add_argument('yaml_path', nargs='?', default='apps.yaml',
+                        help="apps.yaml to compare against (default: apps.yaml)")
+    parser.add_argument('--workers', type=positive_int, default=8,
+                        help="concurrent requests to Flathub (default: 8)")
+    parser.add_argument('--rate', type=positive_float, default=10.0,
+                        help="maximum requests per second (default: 10)")
+    parser.add_argument('--cache', default='flathub-cache.sqlite',
+                        help="verification/details cache (default: flathub-cache.sqlite)")
+    parser.add_argument('--ttl-days', type=float, default=7.0,
+                        help="days before a cached entry is queried again (default: 7)")
+    parser.add_argument('--journal', default='flathub-run.journal',
+                        help="checkpoint journal of the run (default: flathub-run.journal)")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the run recorded in the journal")
+    return parser.parse_args()
 
 def main():
-    # Check for command line argument
-    if len(sys.argv) > 1:
-        yaml_path = sys.argv[1]
-    else:
-        yaml_path = 'apps.yaml'
+    args = parse_args()
+    yaml_path = args.yaml_path
     
     print(f"Reading from YAML file: {yaml_path}")
     
-    # Step 1: Get all Flathub apps
-    flathub_apps, flathub_filename = get_flathub_apps()
-    if not flathub_apps:
-        return
+    session = make_session(args.workers)
+    limiter = TokenBucket(args.rate)
+    cache = FlathubCache(args.cache, args.ttl_days)
+    journal = RunJournal(args.journal, args.resume)
+    date_str = datetime.now().strftime("%Y-%m-%d")
+    
+    # Step 1: Get all Flathub apps, or the snapshot of the run being resumed
+    if journal.snapshot and os.path.exists(journal.snapshot):
+        print(f"Resuming run from {args.journal}: {len(journal.checked)} checked, {len(journal.written)} written")
+        flathub_filename = journal.snapshot
+        flathub_apps = load_snapshot(flathub_filename)
+        output_filename = journal.output
+    else:
+        if args.resume:
+            print(f"Nothing to resume in {args.journal}, starting a new run")
+        flathub_apps, flathub_filename = get_flathub_apps()
+        if not flathub_apps:
+            return
+        output_filename = f"new_verified_flatpaks_{date_str}.yaml"
+        journal.record('start', snapshot=flathub_filename, output=output_filename)
+        
+        previous_apps, previous_filename = load_previous_snapshot(flathub_filename)
+        if previous_filename:
+            added = sum(1 for app in flathub_apps if app not in previous_apps)
+            print(f"{added} apps are new since {previous_filename}")
     
     # Step 2: Load existing apps.yaml (READ ONLY)
     existing_apps = load_apps_yaml_safe(yaml_path)
@@ -203,66 +359,83 @@ def main():
     for app_name, app_data in existing_apps.items():
         if isinstance(app_data, dict) and 'flatpak' in app_data:
             existing_flatpak_ids.add(app_data['flatpak'])
+    del existing_apps
     
     print(f"Found {len(existing_flatpak_ids)} existing flatpak entries in {yaml_path}")
     
-    # Step 3: Find new apps not in apps.yaml
-    new_apps = [app for app in flathub_apps if app not in existing_flatpak_ids]
-    print(f"Found {len(new_apps)} new apps to check for verification")
+    # Steps 3-6 run as one streaming pipeline:
+    # new IDs -> verification -> details -> review file, checkpointed in the journal
+    def verify(app_id):
+        verified = cache.get_verification(app_id)
+        if verified is None:
+            verified = check_verification_status(app_id, session, limiter)
+            # Failed lookups are not cached so the next run retries them
+            if verified is not None:
+                cache.set_verification(app_id, verified)
+        return verified
     
-    # Step 4: Check verification status for new apps
-    verified_apps = []
-    total_new = len(new_apps)
+    def details(app_id):
+        app_details = cache.get_details(app_id)
+        if app_details is None:
+            app_details = get_app_details(app_id, session, limiter)
+            if app_details is not None:
+                cache.set_details(app_id, *app_details)
+        return app_details or (app_id, 'No description available')
     
-    print("Checking verification status...")
-    for i, app_id in enumerate(new_apps, 1):
-        if i % 100 == 0:
-            print(f"Progress: {i}/{total_new}")
-        
-        if check_verification_status(app_id):
-            print(f"  ✓ Verified: {app_id}")
-            verified_apps.append(app_id)
+    def verified_ids(executor):
+        # Verified in an earlier attempt but not written yet
+        for app_id, verified in journal.checked.items():
+            if verified and app_id not in journal.written:
+                yield app_id
         
-        time.sleep(0.05)
-    
-    print(f"\nFound {len(verified_apps)} verified apps that are new")
+        new_apps = (app for app in flathub_apps
+                    if app not in existing_flatpak_ids and app not in journal.checked)
+        for i, (app_id, verified) in enumerate(bounded_map(executor, verify, new_apps, args.workers * 4), 1):
+            if i % 100 == 0:
+                print(f"Progress: {i} checked")
+            if verified is None:
+                continue
+            journal.record('verified', app_id=app_id, verified=verified)
+            if verified:
+                print(f"  ✓ Verified: {app_id}")
+                yield app_id
     
-    # Step 5: Get app details for verified apps
-    if verified_apps:
-        print("\nGetting details for verified apps...")
-        new_apps_data = {}
-        
-        for i, app_id in enumerate(verified_apps, 1):
-            print(f"Getting details {i}/{len(verified_apps)}: {app_id}")
-            
-            name, summary = get_app_details(app_id)
-            yaml_key = generate_yaml_key(name)
-            
-            # Ensure unique key within new apps
-            original_key = yaml_key
-            counter = 1
-            while yaml_key in new_apps_data:
-                yaml_key = f"{original_key}-{counter}"
-                counter += 1
-            
-            new_apps_data[yaml_key] = {
-                'flatpak': app_id,
-                'comment': summary
-            }
-            
-            print(f"  Will add: {yaml_key} -> {app_id} ({name})")
-            time.sleep(0.1)
+    # An interrupted run still commits the cache writes it has batched up
+    try:
+        print(f"Checking new apps with {args.workers} workers at up to {args.rate:g} requests/s...")
+        writer = VerifiedAppsWriter(output_filename, date_str, append=bool(journal.written))
+        used_keys = set(journal.written.values())
         
-        # Step 6: Save new verified apps to separate file
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        output_filename = save_new_verified_apps(new_apps_data, date_str)
+        with ThreadPoolExecutor(max_workers=args.workers) as verify_pool, \
+             ThreadPoolExecutor(max_workers=args.workers) as details_pool:
+            for app_id, (name, summary) in bounded_map(details_pool, details, verified_ids(verify_pool), args.workers * 4):
+                yaml_key = generate_yaml_key(name)
+                
+                # Ensure unique key within new apps
+                original_key = yaml_key
+                counter = 1
+                while yaml_key in used_keys:
+                    yaml_key = f"{original_key}-{counter}"
+                    counter += 1
+                used_keys.add(yaml_key)
+                
+                writer.write(yaml_key, app_id, summary)
+                journal.record('written', app_id=app_id, key=yaml_key)
+                print(f"  Will add: {yaml_key} -> {app_id} ({name})")
         
-        print(f"\n✅ Complete! Found {len(verified_apps)} new verified Flatpak apps")
+        total = len(used_keys)
+        writer.close(total)
+        journal.record('finished')
+    finally:
+        journal.close()
+        cache.close()
+    
+    if total:
+        print(f"\n✅ Complete! Found {total} new verified Flatpak apps")
         print(f"📁 Original apps.yaml: UNCHANGED")
         print(f"📁 All Flathub apps: {flathub_filename}")
         print(f"📁 New verified apps: {output_filename}")
         print(f"\nYou can review {output_filename} and manually add entries to your apps.yaml if desired.")
-        
     else:
         print("\n✅ No new verified apps found")
         print("📁 Original apps.yaml: UNCHANGED")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import requests
+from requests.adapters import HTTPAdapter
+import re
+import json
+import glob
+import time
+import threading
+import argparse
+import sys
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import appsyaml
+from throttle import TokenBucket, positive_float, positive_int
+
+# Fields whose values are shell commands or URLs run at install time
+URL_FIELDS = ('download', 'custom', 'uninstall')
+
+URL_PATTERN = re.compile(r'https?://[^\s\'"<>|;&()`]+')
+
+# Statuses some servers return for HEAD while still serving GET
+HEAD_REFUSED = {400, 403, 404, 405, 501}
+
+# Failures that say nothing about the artifact itself
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+PERMANENT_REDIRECTS = {301, 308}
+
+class HostLimiters:
+    """One token bucket per host, created on first use"""
+    
+    def __init__(self, rate):
+        self.rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+    
+    def acquire(self, url):
+        host = urlsplit(url).hostname or ''
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate)
+        bucket.acquire()
+
+def make_session(pool_size):
+    """Create a requests session keeping up to pool_size keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['user-agent'] = 'appfetch-linkcheck'
+    return session
+
+def extract_urls(apps):
+    """Map every URL in the download/custom/uninstall fields to the apps using it"""
+    urls = {}
+    for name, fields in apps.items():
+        for key in URL_FIELDS:
+            value = fields.get(key)
+            if not isinstance(value, str):
+                continue
+            for match in URL_PATTERN.findall(value):
+                users = urls.setdefault(match.rstrip('.,:'), [])
+                if name not in users:
+                    users.append(name)
+    return urls
+
+def artifact_size(response):
+    """Full size of the artifact behind a HEAD or ranged GET response, if known"""
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else None
+
+def probe(session, url, limiters, timeout):
+    """HEAD a URL, retrying with a one-byte ranged GET when HEAD is refused"""
+    result = {'url': url}
+    started = time.monotonic()
+    try:
+        limiters.acquire(url)
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+        if response.status_code in HEAD_REFUSED:
+            limiters.acquire(url)
+            response = session.get(url, headers={'Range': 'bytes=0-0'}, allow_redirects=True,
+                                   timeout=timeout, stream=True)
+            response.close()
+    except requests.RequestException as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    else:
+        result['http_status'] = response.status_code
+        result['redirects'] = [r.status_code for r in response.history]
+        if response.url != url:
+            result['final_url'] = response.url
+        result['size'] = artifact_size(response) if response.ok else None
+    result['elapsed_ms'] = round((time.monotonic() - started) * 1000)
+    return result
+
+def classify(result, previous_size):
+    """Sort a probe result into ok, dead, unreachable, moved or changed"""
+    status = result.get('http_status')
+    if status is None or status in TRANSIENT_STATUSES:
+        return 'unreachable'
+    if status >= 400:
+        return 'dead'
+    if PERMANENT_REDIRECTS.intersection(result['redirects']):
+        return 'moved'
+    size = result['size']
+    if previous_size is not None and size is not None and size != previous_size:
+        return 'changed'
+    return 'ok'
+
+def load_baseline(path):
+    """Sizes recorded by an earlier report, keyed by URL"""
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return {link['url']: link['size'] for link in report['links'] if link.get('size') is not None}
+
+def find_previous_report(current_filename):
+    """The most recent linkcheck-*.json other than the current one"""
+    reports = sorted(f for f in glob.glob("linkcheck-*.json") if f != current_filename)
+    return reports[-1] if reports else None
+
+def check_links(urls, baseline, workers, rate, timeout):
+    """Probe all URLs concurrently and return their report entries"""
+    session = make_session(workers)
+    limiters = HostLimiters(rate)
+    probed = [url for url in urls if '$' not in url]
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda url: probe(session, url, limiters, timeout), probed))
+    
+    links = []
+    for result in results:
+        previous_size = baseline.get(result['url'])
+        result['status'] = classify(result, previous_size)
+        if result['status'] == 'changed':
+            result['previous_size'] = previous_size
+        result['apps'] = urls[result['url']]
+        links.append(result)
+    
+    # URLs built from shell variables can only be resolved at install time
+    for url in urls:
+        if '$' in url:
+            links.append({'url': url, 'status': 'skipped', 'apps': urls[url]})
+    
+    return sorted(links, key=lambda link: link['url'])
+
+def print_summary(links):
+    """Print every link needing attention, grouped by status"""
+    for status in ('dead', 'moved', 'changed', 'unreachable'):
+        flagged = [link for link in links if link['status'] == status]
+        if not flagged:
+            continue
+        print(f"\n{status.upper()} ({len(flagged)}):")
+        for link in flagged:
+            apps = ', '.join(link['apps'])
+            if status == 'dead':
+                detail = f"HTTP {link['http_status']}"
+            elif status == 'moved':
+                detail = f"-> {link['final_url']}"
+            elif status == 'changed':
+                detail = f"{link['previous_size']} -> {link['size']} bytes"
+            else:
+                detail = link.get('error') or f"HTTP {link['http_status']}"
+            print(f"  [{apps}] {link['url']}  {detail}")
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Check the download URLs in apps.yaml for dead, moved or resized artifacts")
+    parser.add_argument('yaml_path', nargs='?', default='apps.yaml',
+                        help="apps.yaml to check (default: apps.yaml)")
+    parser.add_argument('--workers', type=positive_int, default=32,
+                        help="concurrent requests (default: 32)")
+    parser.add_argument('--rate', type=positive_float, default=5.0,
+                        help="maximum requests per second to any one host (default: 5)")
+    parser.add_argument('--timeout', type=float, default=10.0,
+                        help="seconds to wait for each response (default: 10)")
+    parser.add_argument('--baseline',
+                        help="earlier report to compare sizes against (default: latest linkcheck-*.json)")
+    parser.add_argument('-o', '--output',
+                        help="report file (default: linkcheck-YYYY-MM-DD.json)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    output = args.output or f"linkcheck-{datetime.now().strftime('%Y-%m-%d')}.json"
+    
+    urls = extract_urls(appsyaml.parse(args.yaml_path).apps())
+    print(f"Found {len(urls)} URLs in {args.yaml_path}")
+    
+    baseline_path = args.baseline or find_previous_report(output)
+    baseline = load_baseline(baseline_path) if baseline_path else {}
+    if baseline_path:
+        print(f"Comparing sizes against {baseline_path}")
+    
+    started = time.monotonic()
+    links = check_links(urls, baseline, args.workers, args.rate, args.timeout)
+    
+    summary = {}
+    for link in links:
+        summary[link['status']] = summary.get(link['status'], 0) + 1
+    
+    report = {
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'source': args.yaml_path,
+        'summary': summary,
+        'links': links,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+    
+    print_summary(links)
+    print(f"\nChecked {len(urls)} URLs in {time.monotonic() - started:.1f}s: "
+          + ', '.join(f"{count} {status}" for status, count in sorted(summary.items())))
+    print(f"Report written to {output}")
+    
+    return 1 if summary.get('dead') else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
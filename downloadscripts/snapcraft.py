@@ -1,13 +1,99 @@
 #!/usr/bin/env python3
 
-import subprocess
-import yaml
 import string
 import time
 import os
-import sys
+import argparse
+import http.client
+import json
+import socket
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import appsyaml
+from throttle import TokenBucket, positive_float, positive_int
+
+SNAPD_SOCKET = '/run/snapd.socket'
+
+class SnapdError(Exception):
+    """Error response from snapd"""
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix domain socket"""
+
+    def __init__(self, socket_path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class SnapdClient:
+    """Minimal client for snapd's REST API on its unix socket"""
+
+    def __init__(self, socket_path=SNAPD_SOCKET, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def get(self, path, **params):
+        """GET an endpoint and return the result of snapd's JSON envelope"""
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        
+        conn = UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            body = json.loads(response.read())
+        finally:
+            conn.close()
+        
+        if body.get('type') == 'error':
+            result = body.get('result') or {}
+            raise SnapdError(result.get('kind') or result.get('message') or f"HTTP {response.status}")
+        return body['result']
+
+    def find(self, query=None, section=None, name=None):
+        """Search the store, like `snap find`, returning snap dicts.
+
+        query is snapd's fuzzy free-text search; name matches snap names
+        exactly, or by prefix when it ends in '*'.
+        """
+        params = {}
+        if query:
+            params['q'] = query
+        if section:
+            params['section'] = section
+        if name:
+            params['name'] = name
+        
+        try:
+            results = self.get('/v2/find', **params)
+        except SnapdError as e:
+            # snapd reports an empty search as an error
+            if str(e) == 'snap-not-found':
+                return []
+            raise
+        return [snap_from_api(snap) for snap in results]
+
+def snap_from_api(snap):
+    """Convert a snap from snapd's /v2/find result to our snap dict"""
+    publisher = snap.get('publisher') or {}
+    is_classic = snap.get('confinement') == 'classic'
+    
+    return {
+        'name': snap['name'],
+        'version': snap.get('version', ''),
+        'publisher': publisher.get('username', ''),
+        'verified': publisher.get('validation') == 'verified',
+        'classic': is_classic,
+        'notes': 'classic' if is_classic else '',
+        'summary': snap.get('summary', '')
+    }
+
 def get_snap_sections():
     """Get list of available snap sections"""
     sections = [
@@ -34,255 +120,133 @@ def get_snap_sections():
     ]
     return sections
 
-def get_snap_search_results():
-    """Search through the alphabet and sections to collect all snap results"""
-    all_snaps = []
-    seen_snaps = set()  # To avoid duplicates
+def run_snap_query(client, query, limiter):
+    """Run one store query through snapd.
+
+    Returns (snaps, elapsed seconds, error message or None).
+    """
+    kind, value = query
     
-    print("Searching through alphabet for snaps...")
+    limiter.acquire()
+    started = time.monotonic()
+    snaps = []
+    error = None
     
-    # Search by alphabet
-    for letter in string.ascii_lowercase:
-        print(f"Searching for snaps starting with '{letter}'...")
-        
-        try:
-            result = subprocess.run([
-                'snap', 'search', letter
-            ], capture_output=True, text=True, timeout=30)
-            
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
-                
-                # Skip header line
-                if len(lines) > 1:
-                    found_count = 0
-                    for line in lines[1:]:
-                        if line.strip():
-                            snap_info = parse_snap_line(line)
-                            if snap_info and snap_info['name'] not in seen_snaps:
-                                all_snaps.append(snap_info)
-                                seen_snaps.add(snap_info['name'])
-                                found_count += 1
-                
-                print(f"  Found {found_count} new snaps")
-            else:
-                print(f"  Error searching for '{letter}': {result.stderr}")
-                
-        except subprocess.TimeoutExpired:
-            print(f"  Timeout searching for '{letter}'")
-        except Exception as e:
-            print(f"  Error searching for '{letter}': {e}")
-        
-        # Be nice to the snap store
-        time.sleep(0.5)
+    try:
+        if kind == 'search':
+            snaps = client.find(query=value)
+        elif kind == 'prefix':
+            snaps = client.find(name=f"{value}*")
+        else:
+            snaps = client.find(section=value)
+    except (OSError, http.client.HTTPException, ValueError, SnapdError) as e:
+        error = str(e) or type(e).__name__
     
-    print(f"\nAlphabet search complete. Found {len(all_snaps)} unique snaps so far.")
+    return snaps, time.monotonic() - started, error
+
+# Characters a snap name can continue with when expanding a prefix
+PREFIX_ALPHABET = string.ascii_lowercase + string.digits + '-'
+
+def expand_query(query, page_size, max_depth, min_yield, total, new):
+    """Return the sub-queries for a query whose results look truncated.
+
+    Seed searches and name prefixes are expanded into name prefixes one
+    character longer. Those go through snapd's name=<prefix>* filter rather
+    than the fuzzy q= search, so together they cover exactly the names
+    starting with the parent prefix. A query returning fewer than page_size
+    results is complete, and one whose share of new names fell below
+    min_yield is mostly re-finding snaps we already have, so its children
+    would too.
+    """
+    kind, value = query
+    if kind not in ('search', 'prefix') or len(value) >= max_depth:
+        return []
+    if total < page_size or new < total * min_yield:
+        return []
+    # Snap names never contain two hyphens in a row
+    return [('prefix', value + char) for char in PREFIX_ALPHABET
+            if not (char == '-' and value.endswith('-'))]
+
+def get_snap_search_results(client, workers=4, rate=2.0, page_size=100, max_depth=3, min_yield=0.05):
+    """Crawl the store with an adaptive query plan to collect all snap results.
+
+    The crawl starts from single-letter searches and sections, then runs in
+    waves: each search or prefix that came back full (page_size results) and
+    still produced enough new names is expanded into one-character-longer name
+    prefixes for the next wave, down to max_depth characters. Each wave runs on a bounded worker pool
+    sharing one rate limit and is merged on the calling thread in query order,
+    so deduplication is safe and the outcome doesn't depend on timing.
+    """
+    all_snaps = []
+    seen_snaps = set()  # To avoid duplicates
     
-    # Search by sections
-    print("\nSearching through sections for snaps...")
-    sections = get_snap_sections()
+    queries = [('search', letter) for letter in string.ascii_lowercase]
+    queries += [('section', section) for section in get_snap_sections()]
     
-    for section in sections:
-        print(f"Searching section '{section}'...")
-        
-        try:
-            result = subprocess.run([
-                'snap', 'find', f'--section={section}'
-            ], capture_output=True, text=True, timeout=30)
-            
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
+    print(f"Crawling snap store with {workers} workers at up to {rate:g} queries/s "
+          f"(page size {page_size}, max prefix length {max_depth})...")
+    limiter = TokenBucket(rate)
+    report = []
+    depth_stats = {}
+    unresolved = []
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        depth = 1
+        while queries:
+            print(f"  Wave {depth}: {len(queries)} queries")
+            next_queries = []
+            results = executor.map(lambda query: run_snap_query(client, query, limiter), queries)
+            for query, (snaps, elapsed, error) in zip(queries, results):
+                kind, value = query
+                found_count = 0
+                for snap_info in snaps:
+                    if snap_info['name'] not in seen_snaps:
+                        all_snaps.append(snap_info)
+                        seen_snaps.add(snap_info['name'])
+                        found_count += 1
                 
-                # Skip header line
-                if len(lines) > 1:
-                    found_count = 0
-                    for line in lines[1:]:
-                        if line.strip():
-                            snap_info = parse_snap_line(line)
-                            if snap_info and snap_info['name'] not in seen_snaps:
-                                all_snaps.append(snap_info)
-                                seen_snaps.add(snap_info['name'])
-                                found_count += 1
+                children = [] if error else expand_query(query, page_size, max_depth, min_yield,
+                                                         len(snaps), found_count)
+                next_queries.extend(children)
+                if not error and not children and kind != 'section' and len(snaps) >= page_size:
+                    unresolved.append(value)
                 
-                print(f"  Found {found_count} new snaps in {section}")
-            else:
-                print(f"  Error searching section '{section}': {result.stderr}")
+                stats = depth_stats.setdefault(depth, {'queries': 0, 'results': 0, 'new': 0,
+                                                       'truncated': 0, 'expanded': 0, 'failed': 0})
+                stats['queries'] += 1
+                stats['results'] += len(snaps)
+                stats['new'] += found_count
+                stats['truncated'] += len(snaps) >= page_size
+                stats['expanded'] += bool(children)
+                stats['failed'] += bool(error)
                 
-        except subprocess.TimeoutExpired:
-            print(f"  Timeout searching section '{section}'")
-        except Exception as e:
-            print(f"  Error searching section '{section}': {e}")
-        
-        # Be nice to the snap store
-        time.sleep(0.5)
-    
-    print(f"\nTotal unique snaps found: {len(all_snaps)}")
-    return all_snaps
-
-def parse_snap_line(line):
-    """Parse a line from snap search output"""
-    # Split by multiple spaces to separate columns
-    parts = [part.strip() for part in line.split() if part.strip()]
-    
-    if len(parts) < 5:
-        return None
-    
-    name = parts[0]
-    version = parts[1]
-    publisher = parts[2]
-    notes = parts[3] if parts[3] != '-' else ''
-    summary = ' '.join(parts[4:])
-    
-    # Check if publisher is verified (ends with **)
-    is_verified = publisher.endswith('**')
-    if is_verified:
-        publisher = publisher[:-2]  # Remove the **
-    
-    # Check if it's a classic snap
-    is_classic = 'classic' in notes
-    
-    return {
-        'name': name,
-        'version': version,
-        'publisher': publisher,
-        'verified': is_verified,
-        'classic': is_classic,
-        'notes': notes,
-        'summary': summary
-    }
-
-def load_apps_yaml_safe(yaml_path):
-    """Load YAML file with custom parsing to handle shell commands"""
-    print(f"Loading apps.yaml from: {yaml_path}")
-    
-    if not os.path.exists(yaml_path):
-        print(f"{yaml_path} not found")
-        return {}
-    
-    try:
-        with open(yaml_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Try standard YAML parsing first
-        try:
-            data = yaml.safe_load(content)
-            if data is not None:
-                print(f"Successfully loaded YAML with {len(data)} top-level entries")
-                return data, content
-        except yaml.YAMLError:
-            print("Standard YAML parsing failed, trying custom parsing...")
-        
-        # Custom parsing for your format
-        data = {}
-        current_app = None
-        
-        lines = content.split('\n')
-        i = 0
-        
-        while i < len(lines):
-            line = lines[i]
-            stripped = line.strip()
+                if error:
+                    print(f"  Error in {kind} '{value}': {error}")
+                report.append((f"{kind} {value}", elapsed, len(snaps), found_count, error))
             
-            # Skip empty lines and comments
-            if not stripped or stripped.startswith('#'):
-                i += 1
-                continue
-            
-            # Calculate indentation
-            indent = len(line) - len(line.lstrip())
-            
-            # Top-level app entry (no indentation)
-            if indent == 0 and ':' in line:
-                app_name = line.split(':')[0].strip()
-                current_app = app_name
-                data[current_app] = {}
-                i += 1
-                continue
-            
-            # Sub-entry (indented)
-            if current_app and indent > 0 and ':' in line:
-                key_value = line.strip()
-                if ':' in key_value:
-                    key = key_value.split(':', 1)[0].strip()
-                    value = key_value.split(':', 1)[1].strip()
-                    
-                    # Handle multi-line values (commands with pipes, etc.)
-                    if not value:  # Value is on next lines
-                        i += 1
-                        value_lines = []
-                        while i < len(lines):
-                            next_line = lines[i]
-                            next_indent = len(next_line) - len(next_line.lstrip())
-                            if next_indent > indent and next_line.strip():
-                                value_lines.append(next_line.strip())
-                                i += 1
-                            else:
-                                break
-                        value = ' '.join(value_lines)
-                        i -= 1  # Back up one since we'll increment at end of loop
-                    
-                    data[current_app][key] = value
-            
-            i += 1
-        
-        print(f"Custom parsing successful with {len(data)} top-level entries")
-        return data, content
-        
-    except Exception as e:
-        print(f"Error loading YAML: {e}")
-        return {}, ""
-
-def save_apps_yaml_minimal(yaml_path, original_content, changes):
-    """Save YAML file with minimal changes - only modify what needs to be changed"""
-    lines = original_content.split('\n')
+            queries = next_queries
+            depth += 1
     
-    for app_name, modifications in changes.items():
-        # Find the app section
-        app_line_idx = None
-        for i, line in enumerate(lines):
-            if line.strip() == f"{app_name}:":
-                app_line_idx = i
-                break
-        
-        if app_line_idx is None:
-            continue
-        
-        # Find the end of this app's section
-        section_end = len(lines)
-        for i in range(app_line_idx + 1, len(lines)):
-            line = lines[i]
-            if line.strip() and not line.startswith(' ') and not line.startswith('\t'):
-                section_end = i
-                break
-        
-        # Apply modifications within this section
-        for field, action in modifications.items():
-            if action == 'remove_snap':
-                # Remove the snap: line
-                for i in range(app_line_idx + 1, section_end):
-                    if lines[i].strip().startswith('snap:'):
-                        del lines[i]  # Actually delete instead of emptying
-                        section_end -= 1  # Adjust section end
-                        break
-            elif action.startswith('add_custom:'):
-                custom_value = action[11:]  # Remove 'add_custom:' prefix
-                # Add custom line after app name
-                lines.insert(app_line_idx + 1, f"  custom: {custom_value}")
-                section_end += 1
-            elif action.startswith('add_uninstall:'):
-                uninstall_value = action[14:]  # Remove 'add_uninstall:' prefix
-                # Add uninstall line after custom line
-                custom_line_idx = None
-                for i in range(app_line_idx + 1, section_end):
-                    if lines[i].strip().startswith('custom:'):
-                        custom_line_idx = i
-                        break
-                if custom_line_idx:
-                    lines.insert(custom_line_idx + 1, f"  uninstall: {uninstall_value}")
+    print("\nQuery report:")
+    print(f"  {'query':<32} {'time':>7} {'results':>8} {'new':>5}")
+    for name, elapsed, total, new, error in report:
+        status = " (failed)" if error else ""
+        print(f"  {name:<32} {elapsed:>6.1f}s {total:>8} {new:>5}{status}")
     
-    # Don't filter out empty lines - preserve original spacing
-    with open(yaml_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+    print("\nCoverage by wave:")
+    print(f"  {'wave':>4} {'queries':>8} {'results':>8} {'new':>6} {'yield':>6} {'full':>5} {'expanded':>9} {'failed':>7}")
+    for depth, stats in depth_stats.items():
+        yield_pct = 100 * stats['new'] / stats['results'] if stats['results'] else 0
+        print(f"  {depth:>4} {stats['queries']:>8} {stats['results']:>8} {stats['new']:>6} {yield_pct:>5.0f}% "
+              f"{stats['truncated']:>5} {stats['expanded']:>9} {stats['failed']:>7}")
+    
+    total_queries = sum(stats['queries'] for stats in depth_stats.values())
+    total_results = sum(stats['results'] for stats in depth_stats.values())
+    print(f"\nTotal unique snaps found: {len(all_snaps)} from {total_queries} queries "
+          f"({total_results} results, {len(all_snaps) / max(total_queries, 1):.1f} new per query)")
+    if unresolved:
+        print(f"Still truncated, not expanded further: {', '.join(unresolved)}")
+    return all_snaps
 
 def save_new_verified_snaps(new_snaps_data, date_str):
     """Save new verified snaps to a separate file"""
@@ -309,28 +273,48 @@ def save_new_verified_snaps(new_snaps_data, date_str):
     print(f"Saved {len(new_snaps_data)} new verified snaps to {filename}")
     return filename
 
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Find verified snaps missing from apps.yaml and fix classic snaps")
+    parser.add_argument('yaml_path', nargs='?', default='apps.yaml',
+                        help="apps.yaml to compare against and fix (default: apps.yaml)")
+    parser.add_argument('--workers', type=positive_int, default=4,
+                        help="snap queries run at once (default: 4)")
+    parser.add_argument('--rate', type=positive_float, default=2.0,
+                        help="maximum queries started per second (default: 2)")
+    parser.add_argument('--page-size', type=positive_int, default=100,
+                        help="result count at which a search is treated as truncated (default: 100)")
+    parser.add_argument('--max-depth', type=int, default=3,
+                        help="longest search prefix to expand to (default: 3)")
+    parser.add_argument('--min-yield', type=float, default=0.05,
+                        help="minimum share of new names for a truncated search to be expanded (default: 0.05)")
+    parser.add_argument('--socket', default=SNAPD_SOCKET,
+                        help=f"snapd API socket (default: {SNAPD_SOCKET})")
+    return parser.parse_args()
+
 def main():
-    # Check for command line argument
-    if len(sys.argv) > 1:
-        yaml_path = sys.argv[1]
-    else:
-        yaml_path = 'apps.yaml'
+    args = parse_args()
+    yaml_path = args.yaml_path
     
     print(f"Using YAML file: {yaml_path}")
     
     # Step 1: Get all verified snaps (alphabet + sections)
-    all_snaps = get_snap_search_results()
+    client = SnapdClient(args.socket)
+    all_snaps = get_snap_search_results(client, args.workers, args.rate,
+                                        args.page_size, args.max_depth, args.min_yield)
     verified_snaps = [snap for snap in all_snaps if snap['verified']]
     
     print(f"Found {len(verified_snaps)} verified snaps out of {len(all_snaps)} total")
     
     # Step 2: Load existing apps.yaml
-    existing_apps, original_content = load_apps_yaml_safe(yaml_path)
+    print(f"Loading apps.yaml from: {yaml_path}")
+    document = appsyaml.parse(yaml_path)
+    existing_apps = document.apps()
+    patcher = appsyaml.Patcher(document)
     
     # Step 3: Process verified snaps
     classic_fixes = 0
     new_snaps_data = {}
-    changes_to_make = {}
     
     for snap in verified_snaps:
         snap_name = snap['name']
@@ -344,11 +328,10 @@ def main():
                 if 'snap' in app_data and 'custom' not in app_data:
                     # Convert from regular snap to classic snap
                     print(f"Converting {snap_name} to classic snap in apps.yaml")
-                    changes_to_make[snap_name] = {
-                        'snap': 'remove_snap',
-                        'custom': f"add_custom:sudo snap install {snap_name} --classic",
-                        'uninstall': f"add_uninstall:sudo snap remove {snap_name}"
-                    }
+                    patcher.replace_field(snap_name, 'snap', {
+                        'custom': f"sudo snap install {snap_name} --classic",
+                        'uninstall': f"sudo snap remove {snap_name}"
+                    })
                     classic_fixes += 1
                 else:
                     print(f"Skipping {snap_name} (already properly configured)")
@@ -380,7 +363,8 @@ def main():
     
     # Save apps.yaml if we made classic fixes
     if classic_fixes > 0:
-        save_apps_yaml_minimal(yaml_path, original_content, changes_to_make)
+        patcher.write()
+        appsyaml.write_key_index(yaml_path)
         print(f"\n✅ Updated apps.yaml with {classic_fixes} classic snap fixes")
         changes_made = True
     
@@ -0,0 +1,40 @@
+"""appfetchd's Database reloading apps.yaml when it is replaced"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import appfetchd
+
+class DatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'apps.yaml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def replace(self, text):
+        """Rename a new version over the file, keeping mtime and size as a delta update can"""
+        temp = f"{self.path}.new"
+        with open(temp, 'w') as f:
+            f.write(text)
+        os.utime(temp, ns=(0, 0))
+        os.replace(temp, self.path)
+
+    def test_same_size_replacement_with_the_same_mtime_reloads(self):
+        self.replace("vlc:\n  snap: xyz\n")
+        db = appfetchd.Database(self.path)
+        self.assertEqual(db.refresh().fields['vlc']['snap'], 'xyz')
+
+        self.replace("vlc:\n  snap: abc\n")
+        self.assertEqual(db.refresh().fields['vlc']['snap'], 'abc')
+
+if __name__ == "__main__":
+    unittest.main()
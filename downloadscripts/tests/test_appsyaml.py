@@ -0,0 +1,148 @@
+"""Round-trip tests for appsyaml's parser and Patcher on LF and CRLF files"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import appsyaml
+
+REPO = os.path.dirname(os.path.dirname(HERE))
+
+FIXTURES = {
+    'lf': os.path.join(HERE, 'fixtures', 'apps_lf.yaml'),
+    'crlf': os.path.join(HERE, 'fixtures', 'apps_crlf.yaml'),
+}
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+class PatcherRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+    
+    def copy(self, name):
+        path = os.path.join(self.tmp, f"apps_{name}.yaml")
+        shutil.copyfile(FIXTURES[name], path)
+        return path
+    
+    def test_unedited_file_is_byte_identical(self):
+        for name in FIXTURES:
+            with self.subTest(name):
+                path = self.copy(name)
+                appsyaml.Patcher(appsyaml.parse(path)).write()
+                self.assertEqual(read_bytes(path), read_bytes(FIXTURES[name]))
+    
+    def test_edits_keep_other_lines_and_newline_style(self):
+        for name, newline in (('lf', b'\n'), ('crlf', b'\r\n')):
+            with self.subTest(name):
+                path = self.copy(name)
+                patcher = appsyaml.Patcher(appsyaml.parse(path))
+                patcher.replace_field('reaper', 'custom', {'custom': 'echo replaced'})
+                patcher.set_field('brave', 'aliases', '[brave-browser]')
+                patcher.remove_field('delta', 'comment')
+                patcher.append_entry('added', {'snap': 'added', 'comment': 'New'})
+                patcher.write()
+    
+                original = read_bytes(FIXTURES[name]).splitlines(keepends=True)
+                patched = read_bytes(path).splitlines(keepends=True)
+    
+                # Every line written uses the file's own line ending
+                for line in patched:
+                    self.assertTrue(line.endswith(newline), line)
+                    if newline == b'\n':
+                        self.assertFalse(line.endswith(b'\r\n'), line)
+    
+                self.assertIn(b'  custom: echo replaced' + newline, patched)
+                self.assertIn(b'  aliases: [brave-browser]' + newline, patched)
+                self.assertNotIn(b'    Folded comment' + newline, patched)
+                self.assertEqual(patched[-3:], [b'added:' + newline, b'  snap: added' + newline,
+                                                b'  comment: New' + newline])
+    
+                # Lines nobody edited come through unchanged, trailing spaces included
+                untouched = [line for line in original
+                             if b'custom: mkdir' not in line and b'comment: >' not in line
+                             and b'    Folded' not in line and b'    over two' not in line]
+                for line in untouched:
+                    self.assertIn(line.rstrip(b'\r\n') + newline, patched)
+
+class SpanTest(unittest.TestCase):
+
+    def test_byte_spans_match_lines(self):
+        for name, path in FIXTURES.items():
+            with self.subTest(name):
+                document = appsyaml.parse(path)
+                data = read_bytes(path)
+                self.assertEqual(list(document.entries), ['reaper', 'delta', 'brave'])
+                for entry in document.entries.values():
+                    lines = ''.join(document.lines[entry.start:entry.end]).encode()
+                    self.assertEqual(data[entry.start_byte:entry.end_byte], lines)
+                    for field in entry.fields.values():
+                        lines = ''.join(document.lines[field.start:field.end]).encode()
+                        self.assertEqual(data[field.start_byte:field.end_byte], lines)
+    
+    def test_continuation_lines_join_the_value(self):
+        document = appsyaml.parse(FIXTURES['crlf'])
+        comment = document.entries['delta'].fields['comment']
+        self.assertEqual(comment.value, '> Folded comment over two lines')
+        self.assertEqual(comment.end - comment.start, 3)
+
+class KeyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_published_index_matches_apps_yaml(self):
+        problem = appsyaml.check_key_index(os.path.join(REPO, 'apps.yaml'))
+        self.assertIsNone(problem, "regenerate it with: python3 downloadscripts/appsyaml.py apps.yaml")
+
+    def test_check_notices_an_edited_database(self):
+        path = os.path.join(self.tmp, 'apps.yaml')
+        shutil.copyfile(FIXTURES['lf'], path)
+        self.assertEqual(appsyaml.check_key_index(path), f"{path}.keys is missing")
+
+        appsyaml.write_key_index(path)
+        self.assertIsNone(appsyaml.check_key_index(path))
+
+        with open(path, 'ab') as f:
+            f.write(b'added:\n  snap: added\n')
+        self.assertIn('size or sha256 differs', appsyaml.check_key_index(path))
+
+@unittest.skipUnless(shutil.which('bash'), "needs bash to run appfetch.sh")
+class ShellFieldsTest(unittest.TestCase):
+
+    def bash_fields(self, path):
+        script = ('source "$1"; declare -A data; parse_yaml_lines data < "$2"; '
+                  'for key in "${!data[@]}"; do printf "%s\\0%s\\0" "$key" "${data[$key]}"; done')
+        output = subprocess.run(['bash', '-c', script, 'bash', os.path.join(REPO, 'appfetch.sh'), path],
+                                check=True, capture_output=True).stdout.decode()
+        items = output.split('\0')[:-1]
+        apps = {}
+        for key, value in zip(items[::2], items[1::2]):
+            app, field = key.split(':', 1)
+            apps.setdefault(app, {})[field] = value
+        return apps
+
+    def test_fields_match_appfetch(self):
+        for name, path in FIXTURES.items():
+            with self.subTest(name):
+                with open(path, 'r', encoding='utf-8', newline='') as f:
+                    fields = appsyaml.shell_fields(f.read())
+                self.assertEqual({app: values for app, values in fields.items() if values},
+                                 self.bash_fields(path))
+
+if __name__ == "__main__":
+    unittest.main()
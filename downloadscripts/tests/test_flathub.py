@@ -0,0 +1,50 @@
+"""FlathubCache committing its writes in batches and on close"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import flathub
+
+class FlathubCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def committed(self):
+        """Rows another connection sees, i.e. what survives a crash"""
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM verification").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_writes_are_committed_in_batches_and_on_close(self):
+        cache = flathub.FlathubCache(self.path, ttl_days=7)
+        writes = flathub.CACHE_COMMIT_EVERY + flathub.CACHE_COMMIT_EVERY // 2
+        for i in range(writes):
+            cache.set_verification(f"org.example.App{i}", i % 2 == 0)
+
+        self.assertEqual(self.committed(), flathub.CACHE_COMMIT_EVERY)
+        self.assertTrue(cache.get_verification(f"org.example.App{writes - 2}"))  # pending writes are visible
+
+        cache.close()
+        self.assertEqual(self.committed(), writes)
+
+        cache = flathub.FlathubCache(self.path, ttl_days=7)
+        self.assertFalse(cache.get_verification("org.example.App1"))
+        self.assertIsNone(cache.get_verification("org.example.Missing"))
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
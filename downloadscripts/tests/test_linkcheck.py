@@ -0,0 +1,159 @@
+"""linkcheck's probing and classification against a local HTTP stand-in"""
+
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import linkcheck
+
+class LinkHandler(http.server.BaseHTTPRequestHandler):
+    """Artifacts of fixed sizes, a server refusing HEAD, redirects and failures"""
+
+    sizes = {'/ok': 10, '/nohead': 1234}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', self.path, time.monotonic()))
+        if self.path == '/nohead':
+            self.reply(405)
+        else:
+            self.route()
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, time.monotonic()))
+        if self.path == '/nohead' and self.headers.get('Range') == 'bytes=0-0':
+            self.reply(206, {'Content-Range': f"bytes 0-0/{self.sizes['/nohead']}"}, b'x')
+        else:
+            self.route(body=True)
+
+    def route(self, body=False):
+        path = self.path.split('?')[0]
+        if path == '/moved':
+            self.reply(301, {'Location': '/ok'})
+        elif path == '/found':
+            self.reply(302, {'Location': '/ok'})
+        elif path == '/gone':
+            self.reply(404)
+        elif path == '/busy':
+            self.reply(503)
+        elif path == '/sized':
+            self.reply(200, {'Content-Length': str(self.server.sized)})
+        elif path in self.sizes:
+            self.reply(200, {'Content-Length': str(self.sizes[path])}, b'x' * self.sizes[path] if body else b'')
+        else:
+            self.reply(404)
+
+    def reply(self, status, headers=None, body=b''):
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command == 'GET':
+            self.wfile.write(body)
+
+class LinkcheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), LinkHandler)
+        self.server.requests = []
+        self.server.sized = 1000
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def check(self, paths, baseline=None, rate=100.0):
+        urls = {self.base + path: ['app'] for path in paths}
+        links = linkcheck.check_links(urls, baseline or {}, workers=4, rate=rate, timeout=5)
+        return {link['url'][len(self.base):]: link for link in links}
+
+    def test_statuses(self):
+        links = self.check(['/ok', '/nohead', '/found', '/moved', '/gone', '/busy'])
+        self.assertEqual({path: link['status'] for path, link in links.items()}, {
+            '/ok': 'ok',
+            '/nohead': 'ok',
+            '/found': 'ok',
+            '/moved': 'moved',
+            '/gone': 'dead',
+            '/busy': 'unreachable',
+        })
+        self.assertEqual(links['/ok']['size'], 10)
+        self.assertEqual(links['/moved']['final_url'], self.base + '/ok')
+        self.assertEqual(links['/moved']['redirects'], [301])
+        self.assertEqual(links['/found']['redirects'], [302])
+        self.assertEqual(links['/gone']['http_status'], 404)
+
+    def test_head_refused_falls_back_to_a_ranged_get(self):
+        links = self.check(['/nohead'])
+        self.assertEqual(links['/nohead']['http_status'], 206)
+        self.assertEqual(links['/nohead']['size'], 1234)
+        self.assertEqual([request[:2] for request in self.server.requests],
+                         [('HEAD', '/nohead'), ('GET', '/nohead')])
+
+    def test_size_change_against_baseline(self):
+        report = os.path.join(self.tmp, 'linkcheck-2026-01-01.json')
+        with open(report, 'w') as f:
+            json.dump({'links': [{'url': self.base + '/sized', 'size': 1000}]}, f)
+
+        self.server.sized = 2000
+        links = self.check(['/sized'], linkcheck.load_baseline(report))
+        self.assertEqual(links['/sized']['status'], 'changed')
+        self.assertEqual((links['/sized']['previous_size'], links['/sized']['size']), (1000, 2000))
+
+        self.server.sized = 1000
+        self.assertEqual(self.check(['/sized'], linkcheck.load_baseline(report))['/sized']['status'], 'ok')
+
+    def test_main_writes_report_and_fails_on_dead_links(self):
+        yaml_path = os.path.join(self.tmp, 'apps.yaml')
+        with open(yaml_path, 'w') as f:
+            f.write(f"good:\n  download: {self.base}/ok\n  custom: tar -xf /tmp/good.tar.xz\n"
+                    f"bad:\n  custom: wget {self.base}/gone && tar -xf gone.tar.xz\n"
+                    "later:\n  custom: wget https://example.invalid/$VERSION/app.tar.xz\n")
+        baseline = os.path.join(self.tmp, 'baseline.json')
+        with open(baseline, 'w') as f:
+            json.dump({'links': []}, f)
+        output = os.path.join(self.tmp, 'report.json')
+
+        argv = ['linkcheck.py', yaml_path, '--baseline', baseline, '-o', output, '--workers', '2']
+        with mock.patch.object(sys, 'argv', argv), mock.patch('sys.stdout'):
+            self.assertEqual(linkcheck.main(), 1)
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(report['summary'], {'ok': 1, 'dead': 1, 'skipped': 1})
+        self.assertEqual([link['apps'] for link in report['links'] if link['status'] == 'dead'], [['bad']])
+
+    def test_requests_to_one_host_are_rate_limited(self):
+        # A bucket holds a second's worth of tokens, the rest come at the rate
+        started = time.monotonic()
+        self.check([f"/ok?{i}" for i in range(30)], rate=20.0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+
+        limiters = linkcheck.HostLimiters(20.0)
+        for _ in range(20):
+            limiters.acquire('http://a.example/')
+        started = time.monotonic()
+        limiters.acquire('http://b.example/')
+        self.assertLess(time.monotonic() - started, 0.04)  # other hosts keep their own bucket
+        limiters.acquire('http://a.example/')
+        self.assertGreaterEqual(time.monotonic() - started, 0.03)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""snapcraft's store crawl through SnapdClient against a stand-in snapd on a unix socket"""
+
+import contextlib
+import glob
+import http.server
+import io
+import json
+import os
+import shutil
+import socketserver
+import string
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import snapcraft
+
+# Results snapd returns at most for one query, the crawl's page size
+PAGE_SIZE = 10
+
+def store_snaps():
+    """34 snaps: 'a' and 'bx' need one and two levels of prefixes to list fully"""
+    names = [f"a{c}{i}" for c in 'abc' for i in range(5)]
+    names += [f"bx{c}{i}" for c in 'ab' for i in range(8)]
+    names += ['c1', 'c2', 'c3']
+    snaps = {}
+    for i, name in enumerate(sorted(names)):
+        snaps[name] = {
+            'name': name,
+            'version': '1.0',
+            'summary': f"Summary of {name}",
+            'confinement': 'classic' if name == 'c1' else 'strict',
+            'publisher': {'username': 'pub', 'validation': 'verified' if i % 2 == 0 or name == 'c1' else 'unproven'},
+        }
+    return snaps
+
+class SnapdHandler(http.server.BaseHTTPRequestHandler):
+    """/v2/find with name= prefixes, sections and a q= search matching names by
+    first letter, ranked differently from name order as the store's search is"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.server.queries.append(params)
+        snaps = self.server.snaps
+
+        if 'name' in params:
+            prefix = params['name'].rstrip('*')
+            names = sorted(name for name in snaps if name.startswith(prefix))
+        elif 'q' in params:
+            names = sorted((name for name in snaps if name.startswith(params['q'])), reverse=True)
+        else:
+            names = ['aa0', 'c1'] if params.get('section') == 'featured' else []
+
+        if url.path != '/v2/find':
+            self.reply(404, {'type': 'error', 'result': {'kind': 'not-found', 'message': 'not found'}})
+        elif not names:
+            self.reply(404, {'type': 'error', 'result': {'kind': 'snap-not-found', 'message': 'no snaps found'}})
+        else:
+            self.reply(200, {'type': 'sync', 'result': [snaps[name] for name in names[:PAGE_SIZE]]})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class SnapdServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+class SnapcraftTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp, 'snapd.socket')
+        self.server = SnapdServer(self.socket_path, SnapdHandler)
+        self.server.snaps = store_snaps()
+        self.server.queries = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = snapcraft.SnapdClient(self.socket_path, timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def crawl(self, max_depth):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            snaps = snapcraft.get_snap_search_results(self.client, workers=4, rate=1000.0, page_size=PAGE_SIZE,
+                                                      max_depth=max_depth, min_yield=0.05)
+        return snaps, output.getvalue()
+
+    def test_find_by_query_prefix_and_empty_result(self):
+        self.assertEqual([snap['name'] for snap in self.client.find(name='bxb*')],
+                         [f"bxb{i}" for i in range(8)])
+        self.assertEqual(self.client.find(query='zzz'), [])
+        snap = self.client.find(name='c1*')[0]
+        self.assertEqual((snap['verified'], snap['classic'], snap['notes']), (True, True, 'classic'))
+        self.assertEqual(self.server.queries[:2], [{'name': 'bxb*'}, {'q': 'zzz'}])
+
+    def test_truncated_searches_expand_into_name_prefixes(self):
+        snaps, output = self.crawl(max_depth=3)
+        self.assertEqual(sorted(snap['name'] for snap in snaps), sorted(self.server.snaps))
+
+        names = [query.get('name') for query in self.server.queries]
+        self.assertIn('ab*', names)  # the 'a' search came back full
+        self.assertIn('bxa*', names)  # and so did the 'bx' prefix
+        self.assertNotIn('aba*', names)  # 'ab' was complete with 5 results
+        self.assertNotIn('b--*', names)
+
+        # 26 letter searches and 20 sections, 2 x 37 prefixes, then 37 under 'bx'
+        self.assertIn(f"Total unique snaps found: {len(self.server.snaps)} from {46 + 74 + 37} queries", output)
+        self.assertNotIn('Still truncated', output)
+        waves = output.split('Coverage by wave:')[1].splitlines()[2:5]
+        self.assertEqual([line.split()[:2] for line in waves], [['1', '46'], ['2', '74'], ['3', '37']])
+
+    def test_prefixes_stop_at_max_depth(self):
+        snaps, output = self.crawl(max_depth=2)
+        self.assertEqual(max(len(query.get('name', '*')) for query in self.server.queries), 3)  # 'bx*'
+        self.assertIn('Still truncated, not expanded further: bx', output)
+
+    def test_only_verified_snaps_are_proposed(self):
+        yaml_path = os.path.join(self.tmp, 'apps.yaml')
+        with open(yaml_path, 'w') as f:
+            f.write("c1:\n  snap: c1\n  comment: Classic app\n\naa0:\n  snap: aa0\n  comment: Existing\n")
+
+        argv = ['snapcraft.py', yaml_path, '--socket', self.socket_path, '--rate', '1000',
+                '--page-size', str(PAGE_SIZE)]
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        try:
+            with mock.patch.object(sys, 'argv', argv), contextlib.redirect_stdout(io.StringIO()):
+                snapcraft.main()
+        finally:
+            os.chdir(cwd)
+
+        verified = {name for name, snap in self.server.snaps.items()
+                    if snap['publisher']['validation'] == 'verified'}
+        [proposals] = glob.glob(os.path.join(self.tmp, 'new_verified_snaps_*.yaml'))
+        with open(proposals) as f:
+            proposed = {line[:-2] for line in f if line[0] in string.ascii_lowercase}
+        self.assertEqual(proposed, verified - {'c1', 'aa0'})
+
+        with open(yaml_path) as f:
+            self.assertIn("  custom: sudo snap install c1 --classic\n", f.read())
+
+if __name__ == "__main__":
+    unittest.main()
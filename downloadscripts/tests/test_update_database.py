@@ -0,0 +1,232 @@
+"""update_database in appfetch.sh against a local HTTP stand-in for the update server"""
+
+import difflib
+import email.utils
+import hashlib
+import http.server
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(HERE))
+APPFETCH = os.path.join(REPO, 'appfetch.sh')
+sys.path.insert(0, os.path.dirname(HERE))
+
+import appsyaml
+
+def apps_yaml(vlc_snap):
+    return (f"vlc:\n  snap: {vlc_snap}\n  flatpak: org.videolan.VLC\n  comment: Media player\n"
+            "gimp:\n  flatpak: org.gimp.GIMP\n  aliases: [gimp-editor]\n  comment: Image editor\n").encode()
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def delta(old, new):
+    """A patch as apply_database_delta expects: the new file's sha256, then a unified diff"""
+    diff = difflib.unified_diff(old.decode().splitlines(keepends=True), new.decode().splitlines(keepends=True),
+                                'a/apps.yaml', 'b/apps.yaml')
+    return f"# sha256: {sha256(new)}\n{''.join(diff)}".encode()
+
+class UpdateHandler(http.server.BaseHTTPRequestHandler):
+    """Serves server.files, answering conditional requests like a static file server"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        server = self.server
+        server.requests.append((self.command, self.path, dict(self.headers)))
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = f'"{sha256(body)[:16]}"'
+        if server.send_etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        since = self.headers.get('If-Modified-Since')
+        if server.last_modified and since and \
+           email.utils.parsedate_to_datetime(since) >= email.utils.parsedate_to_datetime(server.last_modified):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if server.send_etag:
+            self.send_header('ETag', etag)
+        if server.last_modified:
+            self.send_header('Last-Modified', server.last_modified)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+@unittest.skipUnless(all(map(shutil.which, ('bash', 'curl', 'patch'))), "needs bash, curl and patch")
+class UpdateDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.home, 'Documents'))
+        self.config = os.path.join(self.home, 'Documents', 'apps.yaml')
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), UpdateHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.send_etag = True
+        self.server.last_modified = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.home)
+
+    def write_config(self, data):
+        with open(self.config, 'wb') as f:
+            f.write(data)
+
+    def read_config(self):
+        with open(self.config, 'rb') as f:
+            return f.read()
+
+    def appfetch(self, script, delta=True):
+        env = dict(os.environ, HOME=self.home, LANG='C.UTF-8',
+                   APPFETCH_UPDATE_URL=f"{self.url}/apps.yaml",
+                   APPFETCH_DELTA_URL=f"{self.url}/deltas" if delta else '')
+        env.pop('APPFETCH_SOCKET', None)
+        return subprocess.run(['bash', '-c', f'source "$1"; {script}', 'bash', APPFETCH],
+                              env=env, capture_output=True, text=True)
+
+    def update(self, delta=True):
+        return self.appfetch('validate_config; update_database', delta)
+
+    def loaded_field(self, key):
+        result = self.appfetch(f'load_config; echo "${{YAML_DATA[{key}]}}"')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.strip()
+
+    def leftovers(self):
+        """Temporary files an update left next to the database"""
+        return [name for name in os.listdir(os.path.dirname(self.config)) if name.startswith('apps.yaml.')]
+
+    def test_full_download_replaces_the_database_and_fetches_its_keys(self):
+        old, new = apps_yaml('vlc'), apps_yaml('vlc-nightly')
+        keys = appsyaml.render_key_index(new)
+        self.write_config(old)
+        inode = os.stat(self.config).st_ino
+        self.server.files = {'/apps.yaml': new, '/apps.yaml.keys': keys}
+
+        result = self.update(delta=False)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(self.read_config(), new)
+        self.assertNotEqual(os.stat(self.config).st_ino, inode)  # renamed into place
+        self.assertEqual(os.stat(self.config).st_mode & 0o777, 0o644)
+        self.assertEqual(self.leftovers(), [])
+        keys_file = os.path.join(self.home, 'Documents', '.apps.yaml.keys')
+        self.assertEqual(os.stat(keys_file).st_mode & 0o777, 0o644)
+        with open(keys_file, 'rb') as f:
+            self.assertEqual(f.read(), keys)
+
+    def test_full_download_builds_keys_when_none_are_published(self):
+        new = apps_yaml('vlc-nightly')
+        self.write_config(apps_yaml('vlc'))
+        self.server.files = {'/apps.yaml': new}
+
+        result = self.update(delta=False)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        keys_file = os.path.join(self.home, 'Documents', '.apps.yaml.keys')
+        self.assertEqual(os.stat(keys_file).st_mode & 0o777, 0o644)
+        with open(keys_file, 'rb') as f:
+            self.assertEqual(f.read(), appsyaml.render_key_index(new))
+
+    def test_unchanged_database_is_not_downloaded_again(self):
+        for validator in ('etag', 'last-modified'):
+            with self.subTest(validator):
+                self.server.send_etag = validator == 'etag'
+                self.server.last_modified = 'Fri, 02 Jan 2026 00:00:00 GMT' if validator == 'last-modified' else None
+                self.server.files = {'/apps.yaml': apps_yaml('vlc')}
+                for name in os.listdir(os.path.dirname(self.config)):
+                    os.unlink(os.path.join(os.path.dirname(self.config), name))
+                self.write_config(apps_yaml('old'))
+                os.utime(self.config, (0, 0))
+                self.assertEqual(self.update(delta=False).returncode, 0)
+                self.assertEqual(self.read_config(), apps_yaml('vlc'))
+
+                self.server.requests.clear()
+                result = self.update(delta=False)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertIn('already up to date', result.stdout)
+                self.assertEqual(self.read_config(), apps_yaml('vlc'))
+                headers = self.server.requests[0][2]
+                if validator == 'etag':
+                    self.assertIn('If-None-Match', headers)
+                else:
+                    self.assertNotIn('If-None-Match', headers)
+                    self.assertIn('If-Modified-Since', headers)
+
+    def test_delta_is_applied_without_a_full_download(self):
+        old, new = apps_yaml('vlc'), apps_yaml('vlc-nightly')
+        self.write_config(old)
+        self.server.files = {'/apps.yaml': new, f"/deltas/{sha256(old)}.patch": delta(old, new)}
+
+        result = self.update()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(self.read_config(), new)
+        self.assertNotIn(('GET', '/apps.yaml'), [request[:2] for request in self.server.requests])
+        self.assertEqual(self.leftovers(), [])
+
+    def test_delta_with_the_wrong_sha256_falls_back_to_a_full_download(self):
+        old, new = apps_yaml('vlc'), apps_yaml('vlc-nightly')
+        patch = delta(old, new).replace(sha256(new).encode(), sha256(b'something else').encode())
+        self.write_config(old)
+        self.server.files = {'/apps.yaml': new, f"/deltas/{sha256(old)}.patch": patch}
+
+        result = self.update()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('Delta update did not apply', result.stdout)
+        self.assertIn(('GET', '/apps.yaml'), [request[:2] for request in self.server.requests])
+        self.assertEqual(self.read_config(), new)
+
+    def test_empty_or_invalid_download_keeps_the_database(self):
+        for body in (b'', b'<html><body>Rate limited</body></html>\n'):
+            with self.subTest(body=body):
+                self.write_config(apps_yaml('vlc'))
+                self.server.files = {'/apps.yaml': body}
+
+                result = self.update(delta=False)
+                self.assertEqual(result.returncode, 1)
+                self.assertIn('empty or invalid', result.stderr)
+                self.assertEqual(self.read_config(), apps_yaml('vlc'))
+                self.assertEqual(self.leftovers(), [])
+
+    def test_same_size_deltas_without_last_modified_refresh_the_index(self):
+        versions = [apps_yaml(name) for name in ('vlc', 'xyz', 'abc')]
+        self.write_config(versions[0])
+        self.assertEqual(self.loaded_field('vlc:snap'), 'vlc')
+
+        for old, new, expected in zip(versions, versions[1:], ('xyz', 'abc')):
+            self.server.files = {'/apps.yaml': new, f"/deltas/{sha256(old)}.patch": delta(old, new)}
+            result = self.update()
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertIn('(delta)', result.stdout)
+            self.assertEqual(self.read_config(), new)
+            self.assertEqual(self.loaded_field('vlc:snap'), expected)
+
+if __name__ == "__main__":
+    unittest.main()